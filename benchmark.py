@@ -0,0 +1,436 @@
+import subprocess
+import os
+import argparse
+import json
+import shlex
+import shutil
+import tempfile
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageDraw, ImageFont
+
+import mp4index
+import splitter_v3
+from splitter_v3 import FFMPEG_PATH, FFPROBE_PATH
+
+
+DEFAULT_SCENARIOS = {
+    "copy": [],
+    "letterbox": ['--letterbox_setting', "-top- Synthetic Part ..part"],
+    "transpose": ['--video_transpose', '1', '--letterbox_setting', "-top- Synthetic Part ..part"],
+    "music": ['--letterbox_setting', "-top- Synthetic Part ..part", '--music_folder', '{music_folder}'],
+    "jobs": ['--letterbox_setting', "-top- Synthetic Part ..part", '--jobs', '4'],
+    "segment": ['--letterbox_setting', "-top- Synthetic Part ..part", '--engine', 'segment'],
+    "music_only": ['--music_folder', '{music_folder}'],
+}
+SPLITTER_VERSIONS = ("v1", "v2", "v3")
+# Options splitter_v2.py understands; scenarios using anything else only run on v3
+V2_OPTIONS = {
+    '--music_folder', '--bg_volume', '--clip_length', '--trim_start', '--trim_end', '--video_naming_convention',
+    '--thumbnail_naming_convention', '--music_file_name', '--letterbox_setting', '--thumbnail_font',
+    '--letterbox_top_font', '--letterbox_bottom_font', '--video_transpose',
+}
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def generate_synthetic_video(output_path, duration, size="1280x720", rate=30):
+    print(f"Generating synthetic video: {output_path} ({size}, {duration} seconds)")
+    cmd = [
+        FFMPEG_PATH,
+        '-f', 'lavfi', '-i', f"testsrc2=size={size}:rate={rate}:duration={duration}",
+        '-f', 'lavfi', '-i', f"sine=frequency=440:sample_rate=48000:duration={duration}",
+        '-c:v', 'libx264', '-preset', 'veryfast', '-g', str(rate * 2),
+        '-c:a', 'aac', '-shortest',
+        output_path, '-y'
+    ]
+    subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return output_path
+
+
+def generate_music_folder(music_dir, tracks=3, track_duration=40):
+    print(f"Generating synthetic music folder: {music_dir} ({tracks} tracks)")
+    os.makedirs(music_dir, exist_ok=True)
+    for index in range(tracks):
+        track_path = os.path.join(music_dir, f"track {index + 1}.mp3")
+        cmd = [
+            FFMPEG_PATH,
+            '-f', 'lavfi', '-i', f"sine=frequency={220 * (index + 1)}:sample_rate=48000:duration={track_duration}",
+            '-c:a', 'libmp3lame', track_path, '-y'
+        ]
+        subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    return music_dir
+
+
+def folder_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class DiskUsageMonitor:
+    def __init__(self, paths, interval=0.2):
+        self.paths = paths
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, sum(folder_size(path) for path in self.paths))
+            self.stopped.wait(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, sum(folder_size(path) for path in self.paths))
+
+
+def run_split(input_path, output_folder, extra_args):
+    argv = ['--input', input_path, '--output_folder', output_folder] + extra_args
+    args = splitter_v3.build_arg_parser().parse_args(argv)
+    started = time.perf_counter()
+    parts = splitter_v3.split_video_fast(args)
+    return time.perf_counter() - started, parts
+
+
+def version_supports(version, options):
+    names = {option for option in options if option.startswith('--')}
+    if version == "v1":
+        # v1 always mixes in music and has no other options
+        return names == {'--music_folder'}
+    if version == "v2":
+        return names <= V2_OPTIONS
+    return True
+
+
+def run_legacy_split(version, input_path, output_folder, extra_args, clip_length):
+    os.makedirs(output_folder, exist_ok=True)
+    ext = os.path.splitext(input_path)[1]
+    if version == "v2":
+        cmd = [sys.executable, os.path.join(REPO_DIR, "splitter_v2.py"), '--input', input_path, '--output_folder', output_folder]
+        cmd += ['--clip_length', str(clip_length)] + extra_args
+        cwd = None
+    else:
+        # v1 writes its intermediates and clip folder into the working directory, so it runs inside the output folder
+        script = (
+            "import sys\n"
+            "sys.path.insert(0, sys.argv[1])\n"
+            "import splitter_v1\n"
+            "splitter_v1.FFMPEG_PATH, splitter_v1.FFPROBE_PATH = sys.argv[2], sys.argv[3]\n"
+            "splitter_v1.split_video_fast(sys.argv[4], clip_length=int(sys.argv[5]), music_folder=sys.argv[6])\n"
+        )
+        music_folder = extra_args[extra_args.index('--music_folder') + 1]
+        cmd = [
+            sys.executable, '-c', script, REPO_DIR, os.path.abspath(FFMPEG_PATH), os.path.abspath(FFPROBE_PATH),
+            os.path.abspath(input_path), str(clip_length), os.path.abspath(music_folder),
+        ]
+        cwd = output_folder
+    started = time.perf_counter()
+    subprocess.run(cmd, cwd=cwd, check=True)
+    wall = time.perf_counter() - started
+    # Both legacy versions name each finished part "<part>_with_thumb<ext>" next to their intermediates
+    parts = [name for _, _, files in os.walk(output_folder) for name in files if name.endswith(f"_with_thumb{ext}")]
+    return wall, parts
+
+
+def run_scenario(work_dir, input_path, duration, name, options, clip_length, music_dir, version="v3"):
+    output_folder = os.path.join(work_dir, "out", version, name)
+    cache_dir = os.path.join(work_dir, "cache", version, name)
+    scratch_dir = os.path.join(work_dir, "scratch", version, name)
+    for folder in (output_folder, cache_dir, scratch_dir):
+        shutil.rmtree(folder, ignore_errors=True)
+
+    extra_args = [option.replace("{music_folder}", music_dir) for option in options]
+
+    # v3 keeps intermediates in its scratch space, so that directory counts towards peak disk usage too
+    with DiskUsageMonitor([output_folder, cache_dir, scratch_dir]) as disk:
+        if version == "v3":
+            wall, parts = run_split(input_path, output_folder, [
+                '--clip_length', str(clip_length), '--cache_dir', cache_dir, '--scratch_dir', scratch_dir
+            ] + extra_args)
+        else:
+            wall, parts = run_legacy_split(version, input_path, output_folder, extra_args, clip_length)
+    result = {
+        "version": version,
+        "scenario": name,
+        "input": os.path.basename(input_path),
+        "options": options,
+        "parts": len(parts or []),
+        "wall_seconds": round(wall, 3),
+        "realtime_factor": round(duration / wall, 3) if wall > 0 else None,
+        "bytes_written": folder_size(output_folder),
+        "peak_disk_bytes": disk.peak,
+    }
+    for folder in (output_folder, cache_dir, scratch_dir):
+        shutil.rmtree(folder, ignore_errors=True)
+    return result
+
+
+def print_results(results):
+    print(f"\n{'version':<8} {'scenario':<12} {'input':<26} {'parts':>5} {'wall s':>9} {'x realtime':>10} {'written MB':>11} {'peak MB':>9}")
+    for result in results:
+        print(
+            f"{result['version']:<8} {result['scenario']:<12} {result['input']:<26} {result['parts']:>5} {result['wall_seconds']:>9.2f} "
+            f"{result['realtime_factor'] or 0:>10.2f} {result['bytes_written'] / 1048576:>11.1f} {result['peak_disk_bytes'] / 1048576:>9.1f}"
+        )
+
+
+def compare_to_baseline(results, baseline_path, max_regression):
+    with open(baseline_path, encoding='utf-8') as f:
+        # Baselines written before versions were benchmarked only hold v3 results
+        baseline = {(r.get("version", "v3"), r["scenario"], r["input"]): r for r in json.load(f)["results"]}
+
+    regressions = []
+    for result in results:
+        previous = baseline.get((result["version"], result["scenario"], result["input"]))
+        if not previous or not previous.get("realtime_factor") or not result["realtime_factor"]:
+            continue
+        change = result["realtime_factor"] / previous["realtime_factor"] - 1
+        print(f"{result['version']} {result['scenario']} on {result['input']}: {change * 100:+.1f}% throughput vs baseline")
+        if change < -max_regression:
+            regressions.append(result)
+    return regressions
+
+
+def benchmark_suite(work_dir, sizes, durations, clip_length, scenarios, versions=SPLITTER_VERSIONS):
+    music_dir = generate_music_folder(os.path.join(work_dir, "music"))
+    results = []
+    for size in sizes:
+        for duration in durations:
+            input_path = generate_synthetic_video(os.path.join(work_dir, f"synthetic_{size}_{duration}s.mp4"), duration, size)
+            for name, options in scenarios.items():
+                for version in versions:
+                    if not version_supports(version, options):
+                        print(f"Skipping {name} on {version}: it does not support {' '.join(o for o in options if o.startswith('--'))}")
+                        continue
+                    results.append(run_scenario(work_dir, input_path, duration, name, options, clip_length, music_dir, version))
+    print_results(results)
+    return results
+
+
+def check_smart_encode(work_dir, duration=60, clip_length=20):
+    input_path = generate_synthetic_video(os.path.join(work_dir, "smart_source.mp4"), duration)
+    output_folder = os.path.join(work_dir, "smart")
+    _, parts = run_split(input_path, output_folder, [
+        '--clip_length', str(clip_length),
+        '--letterbox_setting', "-top- Smart Part ..part",
+        '--smart_encode', '--cache_dir', '',
+    ])
+
+    source_params = splitter_v3.read_video_stream_params(input_path)
+    failures = []
+    for part in parts:
+        video_file = os.path.join(output_folder, f"clip {part['part_num']}.mp4")
+        if part["mode"] != "smart":
+            failures.append(f"part {part['part_num']} was not smart encoded ({part['mode']})")
+        elif splitter_v3.read_video_stream_params(video_file) != source_params:
+            failures.append(f"part {part['part_num']} codec parameters differ from the source")
+        elif not splitter_v3.verify_smart_join(video_file, part["length"]):
+            failures.append(f"part {part['part_num']} has broken timestamps across the join")
+        elif not splitter_v3.decode_video(video_file):
+            failures.append(f"part {part['part_num']} does not decode cleanly")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print(f"Smart encode check: {len(parts) - len(failures)}/{len(parts)} parts passed")
+    return not failures
+
+
+def compare_renditions(work_dir, renditions, duration=120, clip_length=30, size="1920x1080"):
+    input_path = generate_synthetic_video(os.path.join(work_dir, "renditions_source.mp4"), duration, size)
+    letterbox = ['--letterbox_setting', "-top- Rendition Part ..part", '--clip_length', str(clip_length), '--cache_dir', '']
+
+    single_wall, _ = run_split(input_path, os.path.join(work_dir, "renditions_single"), letterbox + ['--renditions', renditions])
+    separate_wall = 0
+    for rendition in renditions.split(","):
+        wall, _ = run_split(input_path, os.path.join(work_dir, f"renditions_{rendition}"), letterbox + ['--renditions', rendition])
+        separate_wall += wall
+
+    print(f"\nRenditions {renditions} on {duration}s of {size}")
+    print(f"{'one decode':>16}: {single_wall:8.2f} s")
+    print(f"{'separate runs':>16}: {separate_wall:8.2f} s ({separate_wall / single_wall:.2f}x)")
+    return {"single_decode": single_wall, "separate_runs": separate_wall}
+
+
+def generate_index_fixtures(work_dir):
+    fixtures_dir = os.path.join(work_dir, "index_fixtures")
+    os.makedirs(fixtures_dir, exist_ok=True)
+    plain = generate_synthetic_video(os.path.join(fixtures_dir, "h264_bframes.mp4"), 12, "640x360")
+    variants = {
+        "hevc.mp4": ['-f', 'lavfi', '-i', "testsrc2=size=640x360:rate=25:duration=8", '-c:v', 'libx265', '-x265-params', 'keyint=50:log-level=error'],
+        "faststart.mp4": ['-i', plain, '-c', 'copy', '-movflags', '+faststart'],
+        "rotated.mp4": ['-display_rotation', '90', '-i', plain, '-c', 'copy'],
+        "trimmed.mov": ['-ss', '3.2', '-i', plain, '-c', 'copy'],
+        "audio_only.m4a": ['-f', 'lavfi', '-i', "sine=frequency=330:duration=9", '-c:a', 'aac'],
+        "fragmented.mp4": ['-i', plain, '-c', 'copy', '-movflags', 'frag_keyframe+empty_moov'],
+    }
+    fixtures = [plain]
+    for name, options in variants.items():
+        path = os.path.join(fixtures_dir, name)
+        subprocess.run([FFMPEG_PATH] + options + [path, '-y'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+        fixtures.append(path)
+    return fixtures
+
+
+def compare_index_to_ffprobe(path):
+    started = time.perf_counter()
+    cmd = [
+        FFPROBE_PATH, '-v', 'error', '-of', 'json', '-show_format', '-show_streams',
+        '-show_entries', 'packet=stream_index,pts_time,flags', path
+    ]
+    expected = splitter_v3.parse_probe_output(json.loads(subprocess.run(cmd, stdout=subprocess.PIPE, check=True).stdout), True)
+    ffprobe_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    try:
+        actual = mp4index.read_mp4_index(path)
+    except mp4index.Mp4IndexError as error:
+        return [], ffprobe_ms, None, str(error)
+    index_ms = (time.perf_counter() - started) * 1000
+
+    mismatches = []
+    for key in ("width", "height", "rotation", "video_codec", "has_audio"):
+        if actual[key] != expected[key]:
+            mismatches.append(f"{key}: {actual[key]!r} != {expected[key]!r}")
+    for key in ("duration", "start_time"):
+        if abs(actual[key] - expected[key]) > 0.001:
+            mismatches.append(f"{key}: {actual[key]:.6f} != {expected[key]:.6f}")
+    if len(actual["keyframes"]) != len(expected["keyframes"]) or any(
+        abs(a - b) > 0.001 for a, b in zip(actual["keyframes"], expected["keyframes"])
+    ):
+        mismatches.append(f"keyframes: {actual['keyframes'][:5]}... != {expected['keyframes'][:5]}...")
+
+    actual_video = splitter_v3.find_video_stream(actual["streams"]) or {}
+    expected_video = splitter_v3.find_video_stream(expected["streams"]) or {}
+    for key in ("pix_fmt", "profile", "level"):
+        if key in expected_video and actual_video.get(key) != expected_video[key]:
+            mismatches.append(f"video {key}: {actual_video.get(key)!r} != {expected_video[key]!r}")
+    return mismatches, ffprobe_ms, index_ms, None
+
+
+def check_mp4_index(work_dir):
+    failures = 0
+    print(f"\n{'fixture':<20} {'ffprobe ms':>10} {'index ms':>9}  result")
+    for path in generate_index_fixtures(work_dir):
+        mismatches, ffprobe_ms, index_ms, fallback = compare_index_to_ffprobe(path)
+        name = os.path.basename(path)
+        if fallback:
+            expected_fallback = name.startswith("fragmented")
+            failures += not expected_fallback
+            print(f"{name:<20} {ffprobe_ms:>10.1f} {'-':>9}  {'falls back' if expected_fallback else 'FAIL'}: {fallback}")
+            continue
+        failures += bool(mismatches)
+        print(f"{name:<20} {ffprobe_ms:>10.1f} {index_ms:>9.2f}  {'FAIL' if mismatches else 'ok'}")
+        for mismatch in mismatches:
+            print(f"    {mismatch}")
+    return not failures
+
+
+def create_thumbnail_uncached(text, output_path, size, font_settings):
+    img = Image.new("RGB", size, font_settings.get("bg_color", "0x000000").replace("0x", "#"))
+    draw = ImageDraw.Draw(img)
+    try:
+        font = ImageFont.truetype(font_settings.get("family", "arial.ttf"), int(font_settings.get("size", 40)))
+    except:
+        font = ImageFont.load_default()
+    bbox = draw.textbbox((0, 0), text, font=font)
+    position = ((size[0] - (bbox[2] - bbox[0])) // 2, (size[1] - (bbox[3] - bbox[1])) // 2)
+    draw.text(position, text, fill=font_settings.get("color", "0xFFFFFF").replace("0x", "#"), font=font)
+    img.save(output_path)
+
+
+def benchmark_thumbnails(work_dir, count, source_size=(3840, 2160), max_size=1280, workers=1):
+    font_settings = splitter_v3.parse_style_arg("-family- arial.ttf -size- 42 -color- 0xFFFFFFFF -bg_color- 0x000000")
+    capped = splitter_v3.capped_size(source_size, max_size)
+    thumb_dir = os.path.join(work_dir, "thumbnails")
+    os.makedirs(thumb_dir, exist_ok=True)
+
+    def run(render, size):
+        started = time.perf_counter()
+        paths = [(f"Part {index + 1}", os.path.join(thumb_dir, f"thumb {index + 1}.jpg")) for index in range(count)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda item: render(item[0], item[1], size, font_settings), paths))
+        return count / (time.perf_counter() - started)
+
+    results = {
+        "uncached_full_size": run(create_thumbnail_uncached, source_size),
+        "cached_capped": run(splitter_v3.create_thumbnail, capped),
+    }
+    print(f"\nThumbnails ({count} renders, source {source_size[0]}x{source_size[1]}, capped {capped[0]}x{capped[1]}, {workers} workers)")
+    for name, rate in results.items():
+        print(f"{name:>20}: {rate:8.1f} thumbnails/s")
+    return results
+
+
+def parse_scenarios(values):
+    if not values:
+        return dict(DEFAULT_SCENARIOS)
+    scenarios = {}
+    for value in values:
+        name, _, options = value.partition('=')
+        scenarios[name] = DEFAULT_SCENARIOS[name] if not options and name in DEFAULT_SCENARIOS else shlex.split(options)
+    return scenarios
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the splitter on synthetic media.")
+    parser.add_argument('--sizes', default="1280x720", help='Comma-separated synthetic input resolutions, e.g. "1280x720,1920x1080"')
+    parser.add_argument('--durations', default="300", help='Comma-separated synthetic input durations in seconds')
+    parser.add_argument('--clip_length', type=int, default=30, help='Length of each video part in seconds')
+    parser.add_argument('--scenario', action='append', help=f'Scenario to run, either a built-in name ({", ".join(DEFAULT_SCENARIOS)}) or "name=splitter options" where {{music_folder}} expands to the generated music; repeatable')
+    parser.add_argument('--versions', default=",".join(SPLITTER_VERSIONS), help='Comma-separated splitter versions to run; scenarios a version cannot express are skipped')
+    parser.add_argument('--output', help='Write results to this JSON file (usable as a later --baseline)')
+    parser.add_argument('--baseline', help='Compare throughput against a previous results JSON file')
+    parser.add_argument('--max_regression', type=float, default=0.15, help='Fail when throughput drops by more than this fraction versus the baseline')
+    parser.add_argument('--work_dir', help='Directory for generated media (defaults to a temporary directory)')
+    parser.add_argument('--check_smart_encode', action='store_true', help='Verify smart re-encode joins on a synthetic clip instead of benchmarking')
+    parser.add_argument('--renditions', help='Compare one multi-rendition run against separate runs per size, e.g. "1080x1920,720x1280"')
+    parser.add_argument('--check_mp4_index', action='store_true', help='Compare the MP4 index reader against ffprobe on generated fixtures instead of benchmarking')
+    parser.add_argument('--thumbnails', type=int, help='Run the thumbnail micro-benchmark with this many renders instead of the split suite')
+    parser.add_argument('--thumbnail_workers', type=int, default=1, help='Threads used by the thumbnail micro-benchmark')
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="splitter_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        if args.check_smart_encode:
+            if not check_smart_encode(work_dir):
+                sys.exit(1)
+        elif args.check_mp4_index:
+            if not check_mp4_index(work_dir):
+                sys.exit(1)
+        elif args.renditions:
+            compare_renditions(work_dir, args.renditions)
+        elif args.thumbnails:
+            benchmark_thumbnails(work_dir, args.thumbnails, workers=args.thumbnail_workers)
+        else:
+            results = benchmark_suite(
+                work_dir,
+                args.sizes.split(","),
+                [int(d) for d in args.durations.split(",")],
+                args.clip_length,
+                parse_scenarios(args.scenario),
+                args.versions.split(","),
+            )
+            if args.output:
+                with open(args.output, 'w', encoding='utf-8') as f:
+                    json.dump({"created": time.time(), "results": results}, f, indent=2)
+            if args.baseline and compare_to_baseline(results, args.baseline, args.max_regression):
+                print("Throughput regressed beyond the allowed threshold.")
+                sys.exit(1)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
@@ -1,64 +1,571 @@
 import os
+import io
+import sys
+import time
+import json
+import math
+import hashlib
 import zipfile
 import shutil
+import argparse
+import collections
+from concurrent.futures import Future, ProcessPoolExecutor
 from PIL import Image
 
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 # 🔧 Set your zip file path here
 INPUT_ZIP = r"C:/Users/91701/Downloads/images.zip"
 
-# Output paths
-BASE_DIR = os.path.dirname(INPUT_ZIP)
-EXTRACT_DIR = os.path.join(BASE_DIR, "extracted_images")
-OUTPUT_DIR = os.path.join(BASE_DIR, "compressed_images")
-OUTPUT_ZIP = os.path.join(BASE_DIR, "optimized_images.zip")
 COMPRESSION_QUALITY = 85
 ALLOWED_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+COPY_CHUNK_SIZE = 1024 * 1024
+MAX_IN_FLIGHT_MB = 256
+RESIZE_MIN_WIDTH = 1500
+RESIZE_WIDTH = 900
+SSIM_THRESHOLD = 0.98
+IMAGE_CACHE_DIR = r"cache/images"
+IMAGE_CACHE_MAX_MB = 1024
+IMAGE_CACHE_MAX_AGE_DAYS = 30
+MIN_QUALITY = 20
+# Typical growth of log JPEG size per quality step, used to extrapolate from a single encode
+SIZE_SLOPE = 0.015
+MAX_TRIALS = 8
+
+
+# Shrink an opened (not yet decoded) image to 900px wide if it is at least 1500px wide, None otherwise
+def resize_image(img, draft=True):
+    if img.width < RESIZE_MIN_WIDTH:
+        return None
+    aspect_ratio = img.height / img.width
+    new_width = RESIZE_WIDTH
+    new_height = int(new_width * aspect_ratio)
+
+    if draft:
+        # JPEG: libjpeg scales by 1/2, 1/4 or 1/8 in the DCT domain while decoding, never below the requested size
+        if img.format == 'JPEG':
+            img.draft(img.mode, (new_width, new_height))
+        # Other formats: cheap box reduction down to about twice the target before the final resample
+        factor = img.width // (new_width * 2)
+        if factor >= 2 and img.mode not in ("P", "1"):
+            img = img.reduce(factor)
+    return img.resize((new_width, new_height), Image.LANCZOS)
+
+
+# Find the highest JPEG quality up to max_quality whose encode fits in max_bytes, returns (data, quality, trials)
+def search_quality(img, max_bytes, max_quality, max_trials=MAX_TRIALS):
+    trials = 0
+    encodes = {}
+
+    def encode(quality, image=img):
+        nonlocal trials
+        trials += 1
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', optimize=True, quality=quality)
+        return buffer.getvalue()
+
+    # Seed the search from a quarter-area trial encode scaled up by the pixel ratio
+    trial = img.reduce(2) if img.width >= 64 and img.height >= 64 else img
+    estimate = len(encode(max_quality, trial)) * (img.width * img.height) / (trial.width * trial.height)
+    quality = max_quality if estimate <= max_bytes else round(max_quality - math.log(estimate / max_bytes) / SIZE_SLOPE)
+    # A --quality below MIN_QUALITY lowers the floor instead of being exceeded
+    floor = min(MIN_QUALITY, max_quality)
+    quality = max(floor, min(max_quality, quality))
+
+    # The answer lies between the highest quality known to fit and the lowest known to miss
+    fit = miss = None
+    while trials < max_trials:
+        if fit is None and miss is not None and trials == max_trials - 1:
+            # Only misses so far, so the last trial goes to the smallest output
+            quality = floor
+        encodes[quality] = encode(quality)
+        if len(encodes[quality]) <= max_bytes:
+            fit = quality
+        else:
+            miss = quality
+        low = floor - 1 if fit is None else fit
+        high = max_quality + 1 if miss is None else miss
+        if high - low <= 1:
+            break
+        if fit is None or miss is None:
+            # Extrapolate from the one known side along the typical size curve
+            known = miss if fit is None else fit
+            target = round(known + math.log(max_bytes / len(encodes[known])) / SIZE_SLOPE)
+        elif len(encodes[miss]) > len(encodes[fit]):
+            # Interpolate log size across the bracket
+            target = math.floor(fit + math.log(max_bytes / len(encodes[fit])) * (miss - fit) / math.log(len(encodes[miss]) / len(encodes[fit])))
+        else:
+            target = (low + high) // 2
+        quality = max(low + 1, min(high - 1, target))
 
-# Step 1: Extract zip file
-with zipfile.ZipFile(INPUT_ZIP, 'r') as zip_ref:
-    zip_ref.extractall(EXTRACT_DIR)
+    quality = fit if fit is not None else min(encodes)
+    return encodes[quality], quality, trials
 
-# Step 2: Duplicate structure
-if os.path.exists(OUTPUT_DIR):
-    shutil.rmtree(OUTPUT_DIR)
-shutil.copytree(EXTRACT_DIR, OUTPUT_DIR)
 
-# Step 3: Resize and compress images
-def process_image(path, quality=85):
+# Resize and compress one opened image into a path or file object, returns a details dict
+def compress_image(img, ext, output, settings):
+    is_png = ext == '.png'
+    details = {"resized": None, "quality": None, "trials": 0, "over_budget": False}
+
+    small = resize_image(img, settings["draft"])
+    if small is not None:
+        img = small
+        details["resized"] = img.size
+
+    if is_png:
+        # Keep transparency and save as PNG
+        img.save(output, format='PNG', optimize=True)
+        return details
+
+    # Convert to RGB if needed and save as JPEG
+    if img.mode in ("RGBA", "P"):
+        img = img.convert("RGB")
+    if not settings.get("max_bytes"):
+        img.save(output, format='JPEG', optimize=True, quality=settings["quality"])
+        details["quality"] = settings["quality"]
+        return details
+
+    data, details["quality"], details["trials"] = search_quality(
+        img, settings["max_bytes"], settings["quality"], settings.get("max_trials", MAX_TRIALS)
+    )
+    details["over_budget"] = len(data) > settings["max_bytes"]
+    if isinstance(output, str):
+        with open(output, 'wb') as f:
+            f.write(data)
+    else:
+        output.write(data)
+    return details
+
+
+def process_image(path, settings):
     try:
         with Image.open(path) as img:
-            ext = os.path.splitext(path)[1].lower()
-            is_png = ext == '.png'
-
-            # Resize if width ≥ 1500px
-            if img.width >= 1500:
-                aspect_ratio = img.height / img.width
-                new_width = 900
-                new_height = int(new_width * aspect_ratio)
-                img = img.resize((new_width, new_height), Image.LANCZOS)
-                print(f"🔻 Resized: {path} ({img.width}x{img.height})")
-
-            if is_png:
-                # Keep transparency and save as PNG
-                img.save(path, optimize=True)
-            else:
-                # Convert to RGB if needed and save as JPEG
-                if img.mode in ("RGBA", "P"):
-                    img = img.convert("RGB")
-                img.save(path, format='JPEG', optimize=True, quality=quality)
-
+            details = compress_image(img, os.path.splitext(path)[1].lower(), path, settings)
+            if details["resized"]:
+                print(f"🔻 Resized: {path} ({details['resized'][0]}x{details['resized'][1]})")
+            if details["trials"]:
+                print(f"🎯 Quality {details['quality']} after {details['trials']} trial encodes{' (over budget)' if details['over_budget'] else ''}")
             print(f"✔ Processed: {path}")
     except Exception as e:
         print(f"✘ Skipped: {path} ({e})")
 
-for root, _, files in os.walk(OUTPUT_DIR):
-    for file in files:
-        if file.lower().endswith(ALLOWED_EXTENSIONS):
-            process_image(os.path.join(root, file), COMPRESSION_QUALITY)
 
-# Step 4: Zip compressed folder
-shutil.make_archive(OUTPUT_ZIP.replace(".zip", ""), 'zip', OUTPUT_DIR)
+def compress_image_bytes(data, name, settings):
+    output = io.BytesIO()
+    with Image.open(io.BytesIO(data)) as img:
+        details = compress_image(img, os.path.splitext(name)[1].lower(), output, settings)
+    return output.getvalue(), details
+
+
+# Runs in worker processes: returns (data, details, error, seconds), keeping the original bytes on failure
+def compress_member(name, data, settings):
+    started = time.perf_counter()
+    try:
+        output, details = compress_image_bytes(data, name, settings)
+        return output, details, None, time.perf_counter() - started
+    except Exception as e:
+        return data, None, str(e), time.perf_counter() - started
+
+
+def is_image_member(info):
+    return not info.is_dir() and info.filename.lower().endswith(ALLOWED_EXTENSIONS)
+
+
+def output_member(info):
+    member = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+    member.compress_type = info.compress_type
+    member.external_attr = info.external_attr
+    member.comment = info.comment
+    return member
+
+
+# Extract, copy and re-zip the whole folder (three copies on disk)
+def compress_zip_folder(input_zip, output_zip, settings):
+    base_dir = os.path.dirname(input_zip)
+    extract_dir = os.path.join(base_dir, "extracted_images")
+    output_dir = os.path.join(base_dir, "compressed_images")
+
+    # Step 1: Extract zip file
+    with zipfile.ZipFile(input_zip, 'r') as zip_ref:
+        zip_ref.extractall(extract_dir)
+
+    # Step 2: Duplicate structure
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    shutil.copytree(extract_dir, output_dir)
+
+    # Step 3: Resize and compress images
+    for root, _, files in os.walk(output_dir):
+        for file in files:
+            if file.lower().endswith(ALLOWED_EXTENSIONS):
+                process_image(os.path.join(root, file), settings)
+
+    # Step 4: Zip compressed folder
+    shutil.make_archive(output_zip.replace(".zip", ""), 'zip', output_dir)
+
+
+def image_cache_key(digest, name, settings):
+    kind = 'png' if name.lower().endswith('.png') else 'jpeg'
+    return hashlib.sha256(
+        json.dumps([digest, kind, settings, RESIZE_MIN_WIDTH, RESIZE_WIDTH], sort_keys=True).encode('utf-8')
+    ).hexdigest()
+
+
+def load_image_cache(cache_dir):
+    index_path = os.path.join(cache_dir, "index.json")
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            print(f"Ignoring unreadable image cache index: {index_path}")
+    return {}
+
+
+def save_image_cache(cache_dir, index):
+    index_path = os.path.join(cache_dir, "index.json")
+    with open(index_path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(index_path + ".tmp", index_path)
+
+
+def read_cached_image(cache_dir, index, key):
+    entry = index.get(key)
+    path = os.path.join(cache_dir, key[:2], key)
+    if not entry or "details" not in entry or not os.path.exists(path) or os.path.getsize(path) != entry["size"]:
+        return None
+    entry["last_used"] = time.time()
+    with open(path, 'rb') as f:
+        return f.read(), entry["details"]
+
+
+def write_cached_image(cache_dir, index, key, data, details):
+    path = os.path.join(cache_dir, key[:2], key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", 'wb') as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+    index[key] = {"size": len(data), "details": details, "last_used": time.time()}
+
+
+# Drop cached images unused for max_age_seconds, then the least recently used until the cache fits in max_bytes
+def evict_image_cache(cache_dir, index, max_bytes, max_age_seconds):
+    now = time.time()
+    evicted = 0
+    total = sum(entry["size"] for entry in index.values())
+    for key in sorted(index, key=lambda k: index[k].get("last_used", 0)):
+        expired = max_age_seconds and now - index[key].get("last_used", 0) > max_age_seconds
+        if not expired and (not max_bytes or total <= max_bytes):
+            break
+        total -= index.pop(key)["size"]
+        path = os.path.join(cache_dir, key[:2], key)
+        if os.path.exists(path):
+            os.remove(path)
+        evicted += 1
+    if evicted:
+        print(f"🧹 Evicted {evicted} cached images, {total / (1024 * 1024):.1f} MB left in {cache_dir}")
+
+
+def print_summary(results, elapsed):
+    processed = [r for r in results if not r["error"]]
+    for r in results:
+        if r["error"]:
+            print(f"✘ Skipped: {r['name']} ({r['error']})")
+    if not results:
+        print("No images found.")
+        return
+    compressed = [r for r in results if r["source"] == "compressed"]
+    bytes_in = sum(r["bytes_in"] for r in results)
+    bytes_out = sum(r["bytes_out"] for r in results)
+    print(
+        f"\n🖼 {len(processed)} processed, {len(results) - len(processed)} skipped, "
+        f"{sum(1 for r in processed if r['details']['resized'])} resized, "
+        f"{bytes_in / (1024 * 1024):.2f} MB → {bytes_out / (1024 * 1024):.2f} MB"
+    )
+    print(
+        f"♻ {len(compressed)} compressed, {sum(1 for r in results if r['source'] == 'cache')} from cache, "
+        f"{sum(1 for r in results if r['source'] == 'duplicate')} duplicates, "
+        f"{sum(r['hash_seconds'] for r in results) * 1000:.0f} ms hashing"
+    )
+    if compressed:
+        timings = sorted(r["seconds"] for r in compressed)
+        slowest = max(compressed, key=lambda r: r["seconds"])
+        print(
+            f"⏱ Per image: mean {sum(timings) / len(timings) * 1000:.0f} ms, "
+            f"median {timings[len(timings) // 2] * 1000:.0f} ms, "
+            f"p95 {timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000:.0f} ms, "
+            f"slowest {slowest['seconds'] * 1000:.0f} ms ({slowest['name']})"
+        )
+    searched = [r["details"]["trials"] for r in compressed if r["details"]["trials"]]
+    if searched:
+        print(
+            f"🎯 Quality search: {sum(searched)} trial encodes for {len(searched)} images "
+            f"(mean {sum(searched) / len(searched):.1f}, max {max(searched)}), "
+            f"{sum(1 for r in processed if r['details']['over_budget'])} still over budget"
+        )
+    print(f"⚡ {len(results) / elapsed if elapsed else 0:.1f} images/sec over {elapsed:.1f}s")
+
+
+# Split an archive budget over the JPEG outputs in proportion to their input size
+def image_budgets(infos, settings, archive_budget):
+    # PNG outputs cannot be size-targeted, so only the other images get a budget
+    targets = [info for info in infos if is_image_member(info) and not info.filename.lower().endswith('.png')]
+    budgets = {}
+    if archive_budget:
+        target_names = {info.filename for info in targets}
+        # Other members, PNGs included, count at their stored size; every member also costs two headers carrying its name
+        fixed = sum(info.compress_size for info in infos if info.filename not in target_names)
+        fixed += sum(76 + 2 * len(info.filename.encode('utf-8')) for info in infos)
+        target_bytes = sum(info.file_size for info in targets) or 1
+        for info in targets:
+            budgets[info.filename] = max(1, int((archive_budget - fixed) * info.file_size / target_bytes))
+    if settings.get("max_bytes"):
+        for info in targets:
+            budgets[info.filename] = min(budgets.get(info.filename, settings["max_bytes"]), settings["max_bytes"])
+    return budgets
+
+
+# Read each member from the input zip and write it straight into the output zip
+def compress_zip_streaming(
+    input_zip, output_zip, settings, workers=1, max_in_flight_mb=MAX_IN_FLIGHT_MB, cache_dir=IMAGE_CACHE_DIR, archive_budget=None,
+    cache_max_mb=IMAGE_CACHE_MAX_MB, cache_max_age_days=IMAGE_CACHE_MAX_AGE_DAYS,
+):
+    started = time.perf_counter()
+    results = []
+    # Members are queued in archive order; images carry a future, other members are copied when reached
+    pending = collections.deque()
+    # Identical payloads still waiting for their first result share its future
+    pending_by_key = {}
+    in_flight = 0
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    cache_index = load_image_cache(cache_dir) if cache_dir else {}
+
+    with zipfile.ZipFile(input_zip, 'r') as zin, zipfile.ZipFile(output_zip, 'w', allowZip64=True) as zout:
+        zout.comment = zin.comment
+
+        def write_next():
+            nonlocal in_flight
+            info, future, counted, key, origin, hash_seconds = pending.popleft()
+            if info.is_dir():
+                zout.writestr(output_member(info), b'')
+            elif future is None:
+                # Other files are copied chunk by chunk, never fully in memory
+                with zin.open(info) as source, zout.open(output_member(info), 'w', force_zip64=info.file_size > 0x7FFFFFFF) as target:
+                    shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+            else:
+                data, details, error, seconds = future.result()
+                in_flight -= counted
+                zout.writestr(output_member(info), data)
+                if origin == "compressed" and not error and cache_dir:
+                    write_cached_image(cache_dir, cache_index, key, data, details)
+                if pending_by_key.get(key) is future:
+                    del pending_by_key[key]
+                results.append({
+                    "name": info.filename, "seconds": seconds, "details": details or {"resized": None, "trials": 0, "over_budget": False}, "error": error,
+                    "bytes_in": info.file_size, "bytes_out": len(data), "source": origin, "hash_seconds": hash_seconds,
+                })
+
+        infos = zin.infolist()
+        budgets = image_budgets(infos, settings, archive_budget)
+        try:
+            for info in infos:
+                if not is_image_member(info):
+                    pending.append((info, None, 0, None, None, 0))
+                    continue
+                while pending and in_flight + info.file_size > max_in_flight_mb * 1024 * 1024:
+                    write_next()
+                data = zin.read(info)
+                member_settings = dict(settings, max_bytes=budgets.get(info.filename))
+                hash_started = time.perf_counter()
+                key = image_cache_key(hashlib.sha256(data).hexdigest(), info.filename, member_settings)
+                hash_seconds = time.perf_counter() - hash_started
+                cached = read_cached_image(cache_dir, cache_index, key) if cache_dir and key not in pending_by_key else None
+
+                if key in pending_by_key:
+                    pending.append((info, pending_by_key[key], 0, key, "duplicate", hash_seconds))
+                    continue
+                if cached:
+                    future = Future()
+                    future.set_result((cached[0], cached[1], None, 0.0))
+                    # Cached outputs wait in memory like compressed ones, so they count against the cap too
+                    in_flight += len(cached[0])
+                    pending.append((info, future, len(cached[0]), key, "cache", hash_seconds))
+                    continue
+                if executor:
+                    future = executor.submit(compress_member, info.filename, data, member_settings)
+                else:
+                    future = Future()
+                    future.set_result(compress_member(info.filename, data, member_settings))
+                in_flight += info.file_size
+                pending_by_key[key] = future
+                pending.append((info, future, info.file_size, key, "compressed", hash_seconds))
+            while pending:
+                write_next()
+        finally:
+            if executor:
+                executor.shutdown()
+            if cache_dir:
+                evict_image_cache(
+                    cache_dir, cache_index,
+                    cache_max_mb * 1024 * 1024 if cache_max_mb else None,
+                    cache_max_age_days * 86400 if cache_max_age_days else None,
+                )
+                save_image_cache(cache_dir, cache_index)
+
+    print_summary(results, time.perf_counter() - started)
+
+
+# Mean SSIM over 8x8 blocks of the luma channel
+def ssim(first, second):
+    a = np.asarray(first.convert("L"), dtype=np.float64)
+    b = np.asarray(second.convert("L"), dtype=np.float64)
+    height, width = (min(a.shape[0], b.shape[0]) // 8) * 8, (min(a.shape[1], b.shape[1]) // 8) * 8
+    a = a[:height, :width].reshape(height // 8, 8, width // 8, 8).swapaxes(1, 2).reshape(-1, 64)
+    b = b[:height, :width].reshape(height // 8, 8, width // 8, 8).swapaxes(1, 2).reshape(-1, 64)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mean_a, mean_b = a.mean(axis=1), b.mean(axis=1)
+    var_a, var_b = a.var(axis=1), b.var(axis=1)
+    covariance = ((a - mean_a[:, None]) * (b - mean_b[:, None])).mean(axis=1)
+    scores = ((2 * mean_a * mean_b + c1) * (2 * covariance + c2)) / ((mean_a ** 2 + mean_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(scores.mean())
+
+
+# Peak resident memory of this process in MB; ru_maxrss is in bytes on macOS and in KB elsewhere
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+# Runs in a fresh worker process per image and path, so the peak RSS growth belongs to this image alone
+def resize_member(data, draft):
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    with Image.open(io.BytesIO(data)) as img:
+        small = resize_image(img, draft)
+        seconds = time.perf_counter() - started
+        pixels = (small.mode, small.size, small.tobytes())
+    peak = peak_rss_mb()
+    return pixels, seconds, peak - baseline if peak is not None else None
+
+
+def check_resize(input_zip, threshold=SSIM_THRESHOLD):
+    timings = {False: [], True: []}
+    peak_rss = {False: [], True: []}
+    scores = []
+    failures = 0
+    with zipfile.ZipFile(input_zip, 'r') as zin:
+        for info in zin.infolist():
+            if not is_image_member(info):
+                continue
+            data = zin.read(info)
+            results, seconds, rss = {}, {}, {}
+            try:
+                with Image.open(io.BytesIO(data)) as img:
+                    if img.width < RESIZE_MIN_WIDTH:
+                        continue
+                for draft in (False, True):
+                    with ProcessPoolExecutor(max_workers=1) as pool:
+                        pixels, seconds[draft], rss[draft] = pool.submit(resize_member, data, draft).result()
+                    results[draft] = Image.frombytes(*pixels)
+            except Exception as e:
+                print(f"✘ Skipped: {info.filename} ({e})")
+                continue
+            for draft in (False, True):
+                timings[draft].append(seconds[draft])
+                if rss[draft] is not None:
+                    peak_rss[draft].append(rss[draft])
+            if np is None:
+                print(f"{info.filename}: full {timings[False][-1] * 1000:.0f} ms, draft {timings[True][-1] * 1000:.0f} ms")
+                continue
+            score = ssim(results[False], results[True])
+            scores.append(score)
+            failures += score < threshold
+            print(
+                f"{'✘' if score < threshold else '✔'} {info.filename}: SSIM {score:.4f}, "
+                f"full {timings[False][-1] * 1000:.0f} ms, draft {timings[True][-1] * 1000:.0f} ms"
+            )
+
+    if not timings[True]:
+        print(f"No images at least {RESIZE_MIN_WIDTH}px wide to compare.")
+        return True
+    for draft, label in ((False, "full decode"), (True, "draft/reduce")):
+        growth = peak_rss[draft]
+        rss = f"mean {sum(growth) / len(growth):.0f} MB, max {max(growth):.0f} MB" if growth else "n/a"
+        print(f"{label:>13}: {sum(timings[draft]) / len(timings[draft]) * 1000:.0f} ms per image, peak RSS growth per image {rss}")
+    if np is None:
+        print("NumPy is not installed, SSIM was not checked.")
+        return True
+    print(f"SSIM min {min(scores):.4f}, mean {sum(scores) / len(scores):.4f}, {failures} below {threshold}")
+    return not failures
+
+
+def parse_size(value):
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    value = value.strip().upper().rstrip("B")
+    try:
+        if value and value[-1] in units:
+            return int(float(value[:-1]) * units[value[-1]])
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' is not a size like 350000, 500K or 2M")
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="Resize and recompress the images inside a zip archive.")
+    parser.add_argument('--input', default=INPUT_ZIP, help='Zip file with the images to compress')
+    parser.add_argument('--output', help='Output zip path (default: optimized_images.zip next to the input)')
+    parser.add_argument('--quality', type=int, default=COMPRESSION_QUALITY, help='JPEG quality used for recompressed images')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes used to compress images in stream mode')
+    parser.add_argument('--max_in_flight_mb', type=int, default=MAX_IN_FLIGHT_MB, help='Cap on image bytes read from the input zip but not yet written to the output in stream mode')
+    parser.add_argument('--max_bytes_per_image', type=parse_size, help='Largest allowed JPEG output per image (e.g. 300K); picks the highest quality up to --quality that fits')
+    parser.add_argument('--archive_budget', type=parse_size, help='Target size of the output zip (e.g. 50M) in stream mode, split over the images in proportion to their input size')
+    parser.add_argument('--max_trials', type=int, default=MAX_TRIALS, help='Most JPEG trial encodes per image when searching for a quality that fits the budget, including the downscaled seed encode (at least 2)')
+    parser.add_argument('--full_decode', action='store_true', help='Decode large images at full resolution before resizing instead of using JPEG draft mode and reduce')
+    parser.add_argument('--check_resize', action='store_true', help='Compare the draft/reduce resize against the full-decode resize (SSIM, time and peak RSS per image) on the input zip instead of compressing')
+    parser.add_argument('--ssim_threshold', type=float, default=SSIM_THRESHOLD, help='Minimum SSIM accepted by --check_resize')
+    parser.add_argument('--cache_dir', default=IMAGE_CACHE_DIR, help='Folder for compressed results keyed by content hash and settings, reused across runs and for duplicate members in stream mode; pass "" to disable')
+    parser.add_argument('--cache_max_mb', type=float, default=IMAGE_CACHE_MAX_MB, help='Maximum total size of cached images in MB (least recently used images are evicted)')
+    parser.add_argument('--cache_max_age_days', type=float, default=IMAGE_CACHE_MAX_AGE_DAYS, help='Evict cached images not used for this many days')
+    parser.add_argument('--mode', choices=['stream', 'folder'], default='stream', help='"stream" reads members straight from the input zip into the output zip; "folder" extracts, copies and re-zips on disk')
+    return parser
+
+
+if __name__ == "__main__":
+    parser = build_arg_parser()
+    args = parser.parse_args()
+    if args.max_trials < 2:
+        parser.error("--max_trials needs at least 2: the seed encode and one full-size encode")
+    output_zip = args.output or os.path.join(os.path.dirname(args.input), "optimized_images.zip")
+    settings = {
+        "quality": args.quality, "draft": not args.full_decode,
+        "max_bytes": args.max_bytes_per_image, "max_trials": args.max_trials,
+    }
+
+    if args.check_resize:
+        sys.exit(0 if check_resize(args.input, args.ssim_threshold) else 1)
+    if args.mode == 'stream':
+        compress_zip_streaming(
+            args.input, output_zip, settings, args.workers, args.max_in_flight_mb, args.cache_dir, args.archive_budget,
+            args.cache_max_mb, args.cache_max_age_days,
+        )
+    else:
+        compress_zip_folder(args.input, output_zip, settings)
 
-# Step 5: Final report
-final_size = os.path.getsize(OUTPUT_ZIP) / (1024 * 1024)
-print(f"\n✅ Done! Optimized zip saved to:\n{OUTPUT_ZIP}\nFinal size: {final_size:.2f} MB")
+    # Step 5: Final report
+    final_size = os.path.getsize(output_zip) / (1024 * 1024)
+    print(f"\n✅ Done! Optimized zip saved to:\n{output_zip}\nFinal size: {final_size:.2f} MB")
+    if args.archive_budget:
+        budget = args.archive_budget / (1024 * 1024)
+        print(f"{'✔ Within' if final_size <= budget else '✘ Over'} the archive budget of {budget:.2f} MB")
@@ -0,0 +1,277 @@
+import math
+import mmap
+import os
+import struct
+
+
+TOP_LEVEL_BOXES = {b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide", b"pnot", b"uuid", b"meta"}
+
+CODEC_NAMES = {
+    b"avc1": "h264", b"avc3": "h264",
+    b"hvc1": "hevc", b"hev1": "hevc",
+    b"av01": "av1", b"vp09": "vp9", b"mp4v": "mpeg4",
+    b"jpeg": "mjpeg", b"png ": "png",
+    b"mp4a": "aac", b"Opus": "opus", b"ac-3": "ac3", b"ec-3": "eac3", b"fLaC": "flac", b".mp3": "mp3",
+}
+HANDLER_TYPES = {b"vide": "video", b"soun": "audio"}
+H264_PROFILES = {
+    66: "Baseline", 77: "Main", 88: "Extended", 100: "High",
+    110: "High 10", 122: "High 4:2:2", 244: "High 4:4:4 Predictive",
+}
+HEVC_PROFILES = {1: "Main", 2: "Main 10", 3: "Main Still Picture", 4: "Rext"}
+CHROMA_FORMATS = {0: "gray", 1: "yuv420p", 2: "yuv422p", 3: "yuv444p"}
+VISUAL_SAMPLE_ENTRY_SIZE = 78
+
+
+class Mp4IndexError(ValueError):
+    pass
+
+
+def iter_boxes(data, start, end):
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            raise Mp4IndexError(f"Truncated '{box_type.decode('latin-1')}' box at offset {offset}")
+        yield box_type, offset + header, offset + size
+        offset += size
+
+
+def find_box(data, start, end, path):
+    for box_type, body, box_end in iter_boxes(data, start, end):
+        if box_type == path[0]:
+            return (body, box_end) if len(path) == 1 else find_box(data, body, box_end, path[1:])
+    return None
+
+
+def read_full_box(data, body):
+    version_flags = struct.unpack_from(">I", data, body)[0]
+    return version_flags >> 24, body + 4
+
+
+def read_time_header(data, body):
+    version, offset = read_full_box(data, body)
+    if version == 1:
+        timescale, duration = struct.unpack_from(">IQ", data, offset + 16)
+    else:
+        timescale, duration = struct.unpack_from(">II", data, offset + 8)
+    return timescale, duration
+
+
+def read_rotation(data, body):
+    version, offset = read_full_box(data, body)
+    offset += 32 if version == 1 else 20
+    offset += 16
+    a, b = struct.unpack_from(">ii", data, offset)
+    if not a and not b:
+        return 0
+    # Same sign convention as ffprobe's display matrix side data: a clockwise rotate=90 reads as -90.
+    return -round(math.degrees(math.atan2(b, a)))
+
+
+def read_sample_entry(data, body):
+    _, offset = read_full_box(data, body)
+    if not struct.unpack_from(">I", data, offset)[0]:
+        return None
+    size, fourcc = struct.unpack_from(">I4s", data, offset + 4)
+    return fourcc, offset + 12, offset + 4 + size
+
+
+def read_avc_config(data, body, end):
+    _, profile_idc, compatibility, level = struct.unpack_from(">BBBB", data, body)
+    stream = {"profile": H264_PROFILES.get(profile_idc), "level": level, "pix_fmt": "yuv420p"}
+    if profile_idc == 66 and compatibility & 0x40:
+        stream["profile"] = "Constrained Baseline"
+
+    offset = body + 6
+    for _ in range(data[body + 5] & 0x1F):
+        offset += 2 + struct.unpack_from(">H", data, offset)[0]
+    parameter_sets = data[offset]
+    offset += 1
+    for _ in range(parameter_sets):
+        offset += 2 + struct.unpack_from(">H", data, offset)[0]
+    if profile_idc in (100, 110, 122, 244) and offset + 3 <= end:
+        chroma_format, bit_depth = struct.unpack_from(">BB", data, offset)
+        stream["pix_fmt"] = pixel_format(chroma_format & 0x03, (bit_depth & 0x07) + 8)
+    return stream
+
+
+def read_hevc_config(data, body):
+    profile_byte = struct.unpack_from(">B", data, body + 1)[0]
+    level = struct.unpack_from(">B", data, body + 12)[0]
+    chroma_format, bit_depth = struct.unpack_from(">BB", data, body + 16)
+    return {
+        "profile": HEVC_PROFILES.get(profile_byte & 0x1F),
+        "level": level,
+        "pix_fmt": pixel_format(chroma_format & 0x03, (bit_depth & 0x07) + 8),
+    }
+
+
+def pixel_format(chroma_format, bit_depth):
+    pix_fmt = CHROMA_FORMATS.get(chroma_format, "yuv420p")
+    return f"{pix_fmt}{bit_depth}le" if bit_depth > 8 else pix_fmt
+
+
+def read_table(data, box, row_format):
+    if not box:
+        return None
+    _, offset = read_full_box(data, box[0])
+    count = struct.unpack_from(">I", data, offset)[0]
+    row_size = struct.calcsize(row_format)
+    if offset + 4 + count * row_size > box[1]:
+        raise Mp4IndexError("Sample table is larger than its box")
+    return list(struct.iter_unpack(row_format, data[offset + 4:offset + 4 + count * row_size]))
+
+
+def read_edit_list(data, box):
+    if not box:
+        return 0, 0
+    version, offset = read_full_box(data, box[0])
+    row_format = ">Qqhh" if version == 1 else ">Iihh"
+    empty = 0
+    for segment_duration, media_time, _, _ in struct.iter_unpack(
+        row_format, data[offset + 4:offset + 4 + struct.unpack_from(">I", data, offset)[0] * struct.calcsize(row_format)]
+    ):
+        if media_time == -1:
+            empty += segment_duration
+        else:
+            return empty, media_time
+    return empty, 0
+
+
+def sample_times(stts, ctts):
+    dts = 0
+    presentation = []
+    for count, delta in stts:
+        for _ in range(count):
+            presentation.append(dts)
+            dts += delta
+    if ctts:
+        index = 0
+        for count, offset in ctts:
+            for position in range(index, min(index + count, len(presentation))):
+                presentation[position] += offset
+            index += count
+    return presentation
+
+
+def read_track(data, body, end, index, movie_timescale):
+    mdia = find_box(data, body, end, [b"mdia"])
+    hdlr = mdia and find_box(data, mdia[0], mdia[1], [b"hdlr"])
+    mdhd = mdia and find_box(data, mdia[0], mdia[1], [b"mdhd"])
+    stbl = mdia and find_box(data, mdia[0], mdia[1], [b"minf", b"stbl"])
+    if not (hdlr and mdhd and stbl):
+        raise Mp4IndexError(f"Track {index} has no media header or sample table")
+
+    handler = struct.unpack_from(">4s", data, hdlr[0] + 8)[0]
+    timescale, _ = read_time_header(data, mdhd[0])
+    if not timescale:
+        raise Mp4IndexError(f"Track {index} has no timescale")
+    stream = {"index": index, "codec_type": HANDLER_TYPES.get(handler, "data"), "disposition": {"attached_pic": 0}}
+
+    stsd = find_box(data, stbl[0], stbl[1], [b"stsd"])
+    entry = stsd and read_sample_entry(data, stsd[0])
+    if entry:
+        fourcc, entry_body, entry_end = entry
+        stream["codec_name"] = CODEC_NAMES.get(fourcc, fourcc.decode('latin-1').strip())
+        if stream["codec_type"] == "video":
+            stream["width"], stream["height"] = struct.unpack_from(">HH", data, entry_body + 24)
+            children = entry_body + VISUAL_SAMPLE_ENTRY_SIZE
+            avcc = find_box(data, children, entry_end, [b"avcC"])
+            hvcc = find_box(data, children, entry_end, [b"hvcC"])
+            if avcc:
+                stream.update(read_avc_config(data, avcc[0], avcc[1]))
+            elif hvcc:
+                stream.update(read_hevc_config(data, hvcc[0]))
+            if fourcc in (b"jpeg", b"png "):
+                stream["disposition"]["attached_pic"] = 1
+
+    stts = read_table(data, find_box(data, stbl[0], stbl[1], [b"stts"]), ">II") or []
+    ctts_box = find_box(data, stbl[0], stbl[1], [b"ctts"])
+    ctts = None
+    if ctts_box:
+        version, _ = read_full_box(data, ctts_box[0])
+        ctts = read_table(data, ctts_box, ">Ii" if version == 1 else ">II")
+    stss = read_table(data, find_box(data, stbl[0], stbl[1], [b"stss"]), ">I")
+
+    empty, media_time = read_edit_list(data, find_box(data, body, end, [b"edts", b"elst"]))
+    delay = empty / movie_timescale
+    presentation = sample_times(stts, ctts)
+    start_time = (max(min(presentation), media_time) - media_time) / timescale + delay if presentation else 0
+
+    keyframes = None
+    if stream["codec_type"] == "video":
+        sync = range(1, len(presentation) + 1) if stss is None else [number for (number,) in stss]
+        keyframes = sorted(
+            (presentation[number - 1] - media_time) / timescale + delay for number in sync if 0 < number <= len(presentation)
+        )
+    tkhd = find_box(data, body, end, [b"tkhd"])
+    rotation = read_rotation(data, tkhd[0]) if tkhd else 0
+    return stream, start_time, keyframes, rotation
+
+
+def read_mp4_index(path):
+    with open(path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise Mp4IndexError(f"{path} is empty")
+    with data:
+        try:
+            return parse_movie(data, path)
+        except (struct.error, IndexError) as error:
+            raise Mp4IndexError(f"{path} has a malformed index: {error}")
+
+
+def parse_movie(data, path):
+    if data[4:8] not in TOP_LEVEL_BOXES:
+        raise Mp4IndexError(f"{path} is not an ISO media file")
+    moov = find_box(data, 0, len(data), [b"moov"])
+    if not moov:
+        raise Mp4IndexError(f"{path} has no moov box")
+    if find_box(data, moov[0], moov[1], [b"mvex"]):
+        raise Mp4IndexError(f"{path} is fragmented, its samples are not indexed in moov")
+    mvhd = find_box(data, moov[0], moov[1], [b"mvhd"])
+    if not mvhd:
+        raise Mp4IndexError(f"{path} has no movie header")
+    movie_timescale, movie_duration = read_time_header(data, mvhd[0])
+    if not movie_timescale:
+        raise Mp4IndexError(f"{path} has no movie timescale")
+
+    streams, start_times = [], []
+    video = None
+    for box_type, body, end in iter_boxes(data, moov[0], moov[1]):
+        if box_type != b"trak":
+            continue
+        stream, start_time, keyframes, rotation = read_track(data, body, end, len(streams), movie_timescale)
+        streams.append(stream)
+        start_times.append(start_time)
+        if video is None and stream["codec_type"] == "video" and not stream["disposition"]["attached_pic"]:
+            video = (stream, keyframes, rotation)
+
+    duration = movie_duration / movie_timescale
+    start_time = min(start_times) if start_times else 0
+    return {
+        "duration": duration,
+        "start_time": start_time,
+        "width": video[0].get("width") if video else None,
+        "height": video[0].get("height") if video else None,
+        "rotation": video[2] if video else 0,
+        "video_codec": video[0].get("codec_name") if video else None,
+        "has_audio": any(stream["codec_type"] == "audio" for stream in streams),
+        "keyframes": video[1] if video else [],
+        "format": {
+            "filename": path,
+            "format_name": "mov,mp4,m4a,3gp,3g2,mj2",
+            "duration": f"{duration:.6f}",
+            "start_time": f"{start_time:.6f}",
+            "size": str(os.path.getsize(path)),
+        },
+        "streams": streams,
+    }
@@ -93,7 +93,7 @@ def add_thumbnail_to_video(video_path, thumbnail_path, output_path):
     ]
     subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
-def split_video_fast(input_path, clip_length=90, trim_start="00:00:00", trim_end=None):
+def split_video_fast(input_path, clip_length=90, trim_start="00:00:00", trim_end=None, music_folder=r"D:/instagram/music/"):
     if not os.path.exists(input_path):
         print("Video file not found.")
         return
@@ -133,7 +133,7 @@ def split_video_fast(input_path, clip_length=90, trim_start="00:00:00", trim_end
         return
 
     # Step 2: Load music files and generate combined background music
-    music_folder = r"D:/instagram/music/"  # << CHANGE THIS TO YOUR MUSIC DIRECTORY
+    # music_folder defaults to D:/instagram/music/ << CHANGE THIS TO YOUR MUSIC DIRECTORY
     music_files = get_music_files_from_directory(music_folder)
     music_dir_name = os.path.basename(os.path.normpath(music_folder)).replace(" ", "_")
     combined_music = f"{music_dir_name}_combined.mp3"
@@ -189,9 +189,10 @@ def split_video_fast(input_path, clip_length=90, trim_start="00:00:00", trim_end
     os.remove(trimmed_video_path)
 
 # Example usage
-split_video_fast(
-    r"D:/icons/K.G.F Chapter 1 (2018).mp4",
-    clip_length=85,
-    trim_start="00:01:45",
-    trim_end="02:00:00"
-)
+if __name__ == "__main__":
+    split_video_fast(
+        r"D:/icons/K.G.F Chapter 1 (2018).mp4",
+        clip_length=85,
+        trim_start="00:01:45",
+        trim_end="02:00:00"
+    )
@@ -2,9 +2,33 @@ import subprocess
 import os
 import json
 import argparse
+import asyncio
 import tempfile
+import time
+import hashlib
+import bisect
+import collections
+import itertools
+import contextlib
+import functools
 from PIL import Image, ImageDraw, ImageFont
 import re
+import shutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import mp4index
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 def hms_to_seconds(hms):
@@ -14,6 +38,505 @@ def hms_to_seconds(hms):
 
 FFPROBE_PATH = r"bin/ffprobe.exe"
 FFMPEG_PATH = r"bin/ffmpeg.exe"
+CACHE_DIR = r"cache"
+LETTERBOX_TEXT_SECONDS = 5
+JOIN_DECODE_SECONDS = 2
+FRAME_SAMPLE_MAX_SIZE = 160
+
+SMART_ENCODERS = {
+    "h264": ("libx264", "h264_mp4toannexb"),
+    "hevc": ("libx265", "hevc_mp4toannexb"),
+}
+SMART_PROFILES = {
+    "libx264": {"Constrained Baseline": "baseline", "Baseline": "baseline", "Main": "main", "High": "high", "High 10": "high10"},
+    "libx265": {"Main": "main", "Main 10": "main10"},
+}
+SMART_STREAM_PARAMS = ("codec_name", "profile", "width", "height", "pix_fmt")
+
+probe_cache = {"path": None, "entries": None, "dirty": False, "spawned": 0, "indexed": 0}
+probe_lock = threading.Lock()
+
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+def configure_probe_cache(cache_dir):
+    path = os.path.join(cache_dir, "probe_cache.json") if cache_dir else None
+    if path != probe_cache["path"]:
+        # Entries probed under the previous cache directory are written there before switching
+        save_probe_cache()
+        with probe_lock:
+            probe_cache["path"] = path
+            probe_cache["entries"] = None
+
+
+def load_probe_cache():
+    if probe_cache["entries"] is None:
+        probe_cache["entries"] = {}
+        if probe_cache["path"] and os.path.exists(probe_cache["path"]):
+            try:
+                with open(probe_cache["path"], encoding='utf-8') as f:
+                    probe_cache["entries"] = json.load(f)
+            except (OSError, ValueError):
+                print(f"Ignoring unreadable probe cache: {probe_cache['path']}")
+    return probe_cache["entries"]
+
+
+# New probes only mark the cache dirty; it is written once after planning and at the end of the run
+def save_probe_cache():
+    with probe_lock:
+        if not probe_cache["path"] or not probe_cache["dirty"]:
+            return
+        os.makedirs(os.path.dirname(probe_cache["path"]) or ".", exist_ok=True)
+        temp_path = probe_cache["path"] + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(probe_cache["entries"], f)
+        os.replace(temp_path, probe_cache["path"])
+        probe_cache["dirty"] = False
+
+
+def find_video_stream(streams):
+    return next(
+        (st for st in streams if st.get('codec_type') == 'video' and not st.get('disposition', {}).get('attached_pic')),
+        None
+    )
+
+
+def parse_probe_output(raw, keyframes):
+    streams = raw.get('streams', [])
+    fmt = raw.get('format', {})
+    video = find_video_stream(streams)
+
+    rotation = 0
+    if video:
+        for side_data in video.get('side_data_list', []):
+            if 'rotation' in side_data:
+                rotation = int(float(side_data['rotation']))
+        if 'rotate' in video.get('tags', {}):
+            rotation = -int(video['tags']['rotate'])
+
+    keyframe_times = None
+    if keyframes:
+        keyframe_times = []
+        if video:
+            keyframe_times = sorted(
+                float(packet['pts_time'])
+                for packet in raw.get('packets', [])
+                if packet.get('stream_index') == video['index'] and 'K' in packet.get('flags', '')
+                and packet.get('pts_time') not in (None, 'N/A')
+            )
+
+    return {
+        "duration": float(fmt.get('duration', 0) or 0),
+        "start_time": float(fmt.get('start_time', 0) or 0),
+        "width": video.get('width') if video else None,
+        "height": video.get('height') if video else None,
+        "rotation": rotation,
+        "video_codec": video.get('codec_name') if video else None,
+        "has_audio": any(st.get('codec_type') == 'audio' for st in streams),
+        "keyframes": keyframe_times,
+        "format": fmt,
+        "streams": streams,
+    }
+
+
+def probe(path, keyframes=False):
+    key = file_fingerprint(path)
+    with probe_lock:
+        cached = info = load_probe_cache().get(key)
+        if info and (info.get("keyframes") is not None if keyframes else not info.get("video_only")):
+            return info
+
+    print(f"Probing media: {path}")
+    try:
+        with profiler.span("mp4_index", path=os.path.basename(path)):
+            info = mp4index.read_mp4_index(path)
+        counter = "indexed"
+    except mp4index.Mp4IndexError as error:
+        print(f"Falling back to ffprobe: {error}")
+        cmd = [FFPROBE_PATH, '-v', 'error', '-of', 'json', '-show_format', '-show_streams']
+        if keyframes:
+            # Only the main video stream's packets are listed, audio packets would dwarf the keyframe index
+            cmd += ['-select_streams', 'V:0', '-show_entries', 'packet=stream_index,pts_time,flags']
+        cmd.append(path)
+        _, stdout = run_ffprobe(cmd)
+        info = parse_probe_output(json.loads(stdout), keyframes)
+        if keyframes:
+            # The other streams were filtered out, so a later full probe is still needed for them
+            info.update(has_audio=None, video_only=True)
+        elif cached and cached.get("keyframes") is not None:
+            info["keyframes"] = cached["keyframes"]
+        counter = "spawned"
+
+    with probe_lock:
+        probe_cache[counter] += 1
+        load_probe_cache()[key] = info
+        probe_cache["dirty"] = True
+    return info
+
+
+def format_seconds(seconds):
+    seconds = int(max(0, seconds))
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class ProgressTracker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.task_ids = itertools.count(1)
+        self.reset()
+
+    def reset(self, json_path=None, interval=1.0):
+        with self.lock:
+            self.json_path = json_path
+            self.interval = interval
+            self.started = time.monotonic()
+            self.last_print = 0
+            self.stages = {}
+            self.tasks = {}
+
+    def _stage(self, stage):
+        return self.stages.setdefault(stage, {"total": 0, "done": 0, "planned": False, "started": time.monotonic()})
+
+    def plan(self, stage, seconds):
+        with self.lock:
+            stage_info = self._stage(stage)
+            stage_info["total"] = seconds
+            stage_info["planned"] = True
+
+    def start_task(self, stage, name, seconds):
+        with self.lock:
+            task_id = next(self.task_ids)
+            stage_info = self._stage(stage)
+            if not stage_info["planned"]:
+                stage_info["total"] += seconds
+            self.tasks[task_id] = {"stage": stage, "name": name, "seconds": seconds, "encoded": 0, "fps": 0, "speed": 0}
+            self._emit(self.tasks[task_id], "start")
+            return task_id
+
+    def update(self, task_id, encoded, fps, speed):
+        with self.lock:
+            self._advance(self.tasks[task_id], encoded, fps, speed)
+            now = time.monotonic()
+            if now - self.last_print >= self.interval:
+                self.last_print = now
+                self._emit(self.tasks[task_id], "progress")
+
+    def finish_task(self, task_id, returncode):
+        with self.lock:
+            task = self.tasks.pop(task_id)
+            self._advance(task, task["seconds"], task["fps"], task["speed"])
+            self._emit(task, "done" if returncode == 0 else "failed")
+
+    def _advance(self, task, encoded, fps, speed):
+        if task["seconds"]:
+            encoded = min(encoded, task["seconds"])
+        self.stages[task["stage"]]["done"] += max(0, encoded - task["encoded"])
+        task["encoded"] = max(task["encoded"], encoded)
+        task["fps"] = fps
+        task["speed"] = speed
+
+    def _snapshot(self, task, event):
+        stage_info = self.stages[task["stage"]]
+        job_done = sum(st["done"] for st in self.stages.values())
+        job_total = sum(st["total"] for st in self.stages.values())
+        elapsed = time.monotonic() - self.started
+        rate = job_done / elapsed if elapsed > 0 else 0
+        return {
+            "time": time.time(),
+            "event": event,
+            "stage": task["stage"],
+            "task": task["name"],
+            "encoded_seconds": round(task["encoded"], 3),
+            "task_seconds": round(task["seconds"], 3),
+            "fps": task["fps"],
+            "speed": task["speed"],
+            "stage_done": round(stage_info["done"], 3),
+            "stage_total": round(stage_info["total"], 3),
+            "job_done": round(job_done, 3),
+            "job_total": round(job_total, 3),
+            "elapsed": round(elapsed, 3),
+            "eta": round((job_total - job_done) / rate, 3) if rate > 0 else None,
+        }
+
+    def _emit(self, task, event):
+        snapshot = self._snapshot(task, event)
+        if event != "start":
+            stage_pct = 100 * snapshot["stage_done"] / snapshot["stage_total"] if snapshot["stage_total"] else 0
+            job_pct = 100 * snapshot["job_done"] / snapshot["job_total"] if snapshot["job_total"] else 0
+            eta = format_seconds(snapshot["eta"]) if snapshot["eta"] is not None else "--:--:--"
+            print(
+                f"[{snapshot['stage']}] {snapshot['task']}: {event} | stage {stage_pct:5.1f}% | "
+                f"{snapshot['fps']:.0f} fps | {snapshot['speed']:.2f}x | job {job_pct:5.1f}% | ETA {eta}"
+            )
+        if self.json_path == "-":
+            print(json.dumps(snapshot))
+        elif self.json_path:
+            with open(self.json_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(snapshot) + "\n")
+
+    def summary(self):
+        with self.lock:
+            elapsed = time.monotonic() - self.started
+            print(f"Finished in {format_seconds(elapsed)}")
+            for stage, stage_info in self.stages.items():
+                stage_elapsed = time.monotonic() - stage_info["started"]
+                speed = stage_info["done"] / stage_elapsed if stage_elapsed > 0 else 0
+                print(f"  {stage}: {stage_info['done']:.1f}/{stage_info['total']:.1f} media seconds, {speed:.2f}x realtime")
+
+
+progress = ProgressTracker()
+
+
+def parse_progress_float(value):
+    try:
+        return float(value.rstrip('x'))
+    except (AttributeError, ValueError):
+        return 0.0
+
+
+class Profiler:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, enabled=False):
+        with self.lock:
+            self.enabled = enabled
+            self.started = time.perf_counter()
+            self.events = []
+
+    @contextlib.contextmanager
+    def span(self, name, category="stage", **details):
+        if not self.enabled:
+            yield {}
+            return
+        metrics = {}
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield metrics
+        finally:
+            wall_end = time.perf_counter()
+            metrics.setdefault("cpu_seconds", time.thread_time() - cpu_start)
+            event = {
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": (wall_start - self.started) * 1000000,
+                "dur": (wall_end - wall_start) * 1000000,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": dict(details, **metrics),
+            }
+            with self.lock:
+                self.events.append(event)
+
+    def write_trace(self, path):
+        print(f"Writing profile trace: {path}")
+        with self.lock:
+            trace = {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(trace, f)
+
+    def summary(self):
+        with self.lock:
+            events = list(self.events)
+        rows = {}
+        for event in events:
+            row = rows.setdefault((event["cat"], event["name"]), {"count": 0, "wall": 0, "cpu": 0, "rss": 0, "read": 0, "written": 0})
+            row["count"] += 1
+            row["wall"] += event["dur"] / 1000000
+            row["cpu"] += event["args"].get("cpu_seconds", 0)
+            row["rss"] = max(row["rss"], event["args"].get("peak_rss_bytes", 0))
+            row["read"] += event["args"].get("bytes_read", 0)
+            row["written"] += event["args"].get("bytes_written", 0)
+
+        print(f"{'category':<11} {'span':<20} {'count':>6} {'wall s':>9} {'cpu s':>9} {'peak MB':>9} {'read MB':>9} {'write MB':>9}")
+        for (category, name), row in sorted(rows.items(), key=lambda item: -item[1]["wall"]):
+            print(
+                f"{category:<11} {name:<20} {row['count']:>6} {row['wall']:>9.2f} {row['cpu']:>9.2f} "
+                f"{row['rss'] / 1048576:>9.1f} {row['read'] / 1048576:>9.1f} {row['written'] / 1048576:>9.1f}"
+            )
+
+
+profiler = Profiler()
+
+
+class ScratchSpace:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.names = itertools.count(1)
+        self.directory = None
+        self.reset()
+
+    def reset(self, root=None):
+        with self.lock:
+            self.root = root
+            self.sizes = {}
+            self.current = 0
+            self.peak = 0
+
+    def path(self, name):
+        with self.lock:
+            if self.directory is None:
+                if self.root:
+                    os.makedirs(self.root, exist_ok=True)
+                self.directory = tempfile.mkdtemp(prefix="splitter_", dir=self.root or None)
+            return os.path.join(self.directory, f"{next(self.names)}_{name}")
+
+    def track(self, path):
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        with self.lock:
+            self.current += size - self.sizes.get(path, 0)
+            self.sizes[path] = size
+            self.peak = max(self.peak, self.current)
+
+    def release(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        with self.lock:
+            self.current -= self.sizes.pop(path, 0)
+
+    def cleanup(self):
+        with self.lock:
+            directory, self.directory = self.directory, None
+        if directory:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def summary(self):
+        print(f"Peak scratch usage: {self.peak / 1048576:.1f} MB in {self.root or tempfile.gettempdir()}")
+
+
+scratch = ScratchSpace()
+
+
+def sample_child_usage(process, metrics):
+    if psutil is None or not profiler.enabled:
+        return
+    try:
+        child = psutil.Process(process.pid)
+        memory = child.memory_info()
+        cpu = child.cpu_times()
+        metrics["peak_rss_bytes"] = max(metrics.get("peak_rss_bytes", 0), getattr(memory, "peak_wset", memory.rss))
+        metrics["cpu_seconds"] = cpu.user + cpu.system
+        if hasattr(child, "io_counters"):
+            io = child.io_counters()
+            metrics["bytes_read"] = io.read_bytes
+            metrics["bytes_written"] = io.write_bytes
+    except (psutil.Error, OSError):
+        pass
+
+
+def wait_child(process, metrics):
+    if not hasattr(os, "wait4"):
+        return process.wait()
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    rss_scale = 1 if sys.platform == "darwin" else 1024
+    metrics["cpu_seconds"] = usage.ru_utime + usage.ru_stime
+    metrics["peak_rss_bytes"] = usage.ru_maxrss * rss_scale
+    metrics.setdefault("bytes_read", usage.ru_inblock * 512)
+    metrics.setdefault("bytes_written", usage.ru_oublock * 512)
+    return process.returncode
+
+
+async_runner = {"loop": None, "timeout": None, "stopping": False}
+
+
+async def run_child_async(cmd, name, on_line=None):
+    with profiler.span(name, "subprocess", command=os.path.basename(cmd[0])) as metrics:
+        process = await asyncio.create_subprocess_exec(*cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stderr_tail = collections.deque(maxlen=20)
+        stdout_lines = []
+
+        async def read_stdout():
+            async for line in process.stdout:
+                line = line.decode('utf-8', errors='replace')
+                if on_line:
+                    on_line(line)
+                else:
+                    stdout_lines.append(line)
+
+        async def read_stderr():
+            async for line in process.stderr:
+                stderr_tail.append(line.decode('utf-8', errors='replace'))
+
+        try:
+            # Both pipes are drained concurrently, so a chatty child can never block on a full stderr buffer.
+            await asyncio.wait_for(asyncio.gather(read_stdout(), read_stderr(), process.wait()), async_runner["timeout"])
+        except asyncio.TimeoutError:
+            print(f"{name} exceeded the {async_runner['timeout']}s task timeout, killing pid {process.pid}")
+            process.kill()
+            await process.wait()
+        except asyncio.CancelledError:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+        metrics["returncode"] = process.returncode
+    return process.returncode, "".join(stdout_lines), "".join(stderr_tail)
+
+
+def run_child(cmd, name, on_line=None, feed=None):
+    if async_runner["stopping"]:
+        raise RuntimeError("The run was cancelled")
+    if async_runner["loop"] and not feed:
+        return asyncio.run_coroutine_threadsafe(run_child_async(cmd, name, on_line), async_runner["loop"]).result()
+    with profiler.span(name, "subprocess", command=os.path.basename(cmd[0])) as metrics:
+        process = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE if feed else None, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True, encoding='utf-8', errors='replace'
+        )
+        stderr_tail = collections.deque(maxlen=20)
+        stderr_reader = threading.Thread(target=stderr_tail.extend, args=(process.stderr,), daemon=True)
+        stderr_reader.start()
+        if feed:
+            # The feeder writes binary media into stdin while this thread keeps draining progress and stderr.
+            threading.Thread(target=feed, args=(process.stdin,), daemon=True).start()
+
+        stdout_lines = []
+        last_sample = 0
+        for line in process.stdout:
+            if on_line:
+                on_line(line)
+            else:
+                stdout_lines.append(line)
+            if time.monotonic() - last_sample >= 0.5:
+                last_sample = time.monotonic()
+                sample_child_usage(process, metrics)
+
+        returncode = wait_child(process, metrics)
+        stderr_reader.join()
+        metrics["returncode"] = returncode
+    return returncode, "".join(stdout_lines), "".join(stderr_tail)
+
+
+def run_ffprobe(cmd):
+    returncode, stdout, _ = run_child(cmd, "ffprobe")
+    return returncode, stdout
+
+
+def run_ffmpeg(cmd, stage, media_duration=0, name=None, feed=None):
+    name = name or os.path.basename(cmd[-2] if cmd[-1] == '-y' else cmd[-1])
+    task_id = progress.start_task(stage, name, media_duration)
+    values = {}
+
+    def on_line(line):
+        key, _, value = line.strip().partition('=')
+        values[key] = value
+        if key == 'progress':
+            encoded = parse_progress_float(values.get('out_time_us')) / 1000000
+            progress.update(task_id, encoded, parse_progress_float(values.get('fps')), parse_progress_float(values.get('speed')))
+
+    full_cmd = [cmd[0], '-progress', 'pipe:1', '-nostats'] + cmd[1:]
+    returncode, _, stderr_tail = run_child(full_cmd, f"ffmpeg {stage}", on_line, feed)
+    progress.finish_task(task_id, returncode)
+    if returncode != 0:
+        print(f"ffmpeg exited with {returncode} for {name}:\n{stderr_tail}")
+    return returncode
 
 
 def get_music_files_from_directory(music_dir):
@@ -21,21 +544,15 @@ def get_music_files_from_directory(music_dir):
     supported_exts = ('.mp3', '.wav', '.aac', '.m4a')
     return [
         os.path.join(music_dir, f)
-        for f in os.listdir(music_dir)
+        for f in sorted(os.listdir(music_dir))
         if f.lower().endswith(supported_exts)
     ]
 
 
 def get_audio_duration(file_path):
     print(f"Getting audio duration for: {file_path}")
-    result = subprocess.run([
-        FFPROBE_PATH, '-v', 'error',
-        '-show_entries', 'format=duration',
-        '-of', 'default=noprint_wrappers=1:nokey=1',
-        file_path
-    ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     try:
-        return float(result.stdout.strip())
+        return probe(file_path)["duration"]
     except:
         return 0
 
@@ -45,45 +562,207 @@ def combine_and_loop_music(music_paths, total_duration, output_audio_path):
     if not music_paths:
         return None
 
+    durations = {path: get_audio_duration(path) for path in music_paths}
+    if sum(durations.values()) <= 0:
+        print("Music files have no measurable duration.")
+        return None
+
     looped_list = []
     accumulated_duration = 0
     music_index = 0
 
-    with tempfile.NamedTemporaryFile(delete=False, mode='w', suffix='.txt', encoding='utf-8') as temp_file:
-        while accumulated_duration < total_duration:
-            music_path = music_paths[music_index % len(music_paths)]
-            duration = get_audio_duration(music_path)
-            looped_list.append(f"file '{os.path.abspath(music_path)}'")
-            accumulated_duration += duration
-            music_index += 1
+    while accumulated_duration < total_duration:
+        music_path = music_paths[music_index % len(music_paths)]
+        duration = durations[music_path]
+        looped_list.append(f"file '{os.path.abspath(music_path)}'")
+        accumulated_duration += duration
+        music_index += 1
 
+    concat_list_path = scratch.path("music_list.txt")
+    with open(concat_list_path, 'w', encoding='utf-8') as temp_file:
         temp_file.write('\n'.join(looped_list))
-        concat_list_path = temp_file.name
+    scratch.track(concat_list_path)
 
+    # Write under a temporary name so a failed concat never leaves a partial bed in place
+    temp_audio_path = partial_path(output_audio_path)
     concat_cmd = [
         FFMPEG_PATH, '-f', 'concat', '-safe', '0', '-i', concat_list_path,
-        '-c', 'copy', output_audio_path, '-y'
+        '-c', 'copy', temp_audio_path, '-y'
     ]
-    subprocess.run(concat_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    os.remove(concat_list_path)
+    returncode = run_ffmpeg(concat_cmd, "music", total_duration, name=os.path.basename(output_audio_path))
+    scratch.release(concat_list_path)
+    if returncode != 0 or not os.path.exists(temp_audio_path):
+        print(f"Failed to combine music files into: {output_audio_path}")
+        if os.path.exists(temp_audio_path):
+            os.remove(temp_audio_path)
+        return None
+    os.replace(temp_audio_path, output_audio_path)
     return output_audio_path
 
 
-def replace_video_audio(video_path, music_path, output_path, bg_volume):
-    print(f"Replacing audio in {video_path} with {music_path} at volume {bg_volume}")
-    cmd = [
-        FFMPEG_PATH,
-        '-i', video_path,
-        '-i', music_path,
-        '-filter_complex',
-        f'[1:a]volume={bg_volume}[a1];[0:a][a1]amix=inputs=2:duration=first:dropout_transition=3[a]',
-        '-map', '0:v',
-        '-map', '[a]',
-        '-c:v', 'copy',
-        '-shortest',
-        output_path, '-y'
-    ]
-    subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+music_bed_lock = threading.Lock()
+
+
+def music_folder_fingerprint(music_paths):
+    digest = hashlib.sha1()
+    for path in music_paths:
+        stat = os.stat(path)
+        digest.update(f"{os.path.basename(path)}|{stat.st_size}|{stat.st_mtime_ns}\n".encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def load_music_bed_index(bed_dir):
+    index_path = os.path.join(bed_dir, "index.json")
+    if os.path.exists(index_path):
+        try:
+            with open(index_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            print(f"Ignoring unreadable music bed index: {index_path}")
+    return {"beds": {}, "stats": {"hits": 0, "misses": 0}}
+
+
+def save_music_bed_index(bed_dir, index):
+    index_path = os.path.join(bed_dir, "index.json")
+    with open(index_path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2)
+    os.replace(index_path + ".tmp", index_path)
+
+
+def evict_music_beds(bed_dir, index, max_bytes, max_age_seconds, keep=None):
+    now = time.time()
+    beds = index["beds"]
+    for name, bed in list(beds.items()):
+        path = os.path.join(bed_dir, name)
+        expired = max_age_seconds and now - bed["last_used"] > max_age_seconds
+        if name != keep and (expired or not os.path.exists(path)):
+            print(f"Evicting music bed: {name}")
+            beds.pop(name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    total = sum(bed["size"] for bed in beds.values())
+    for name in sorted(beds, key=lambda n: beds[n]["last_used"]):
+        if not max_bytes or total <= max_bytes:
+            break
+        if name == keep:
+            continue
+        print(f"Evicting music bed: {name}")
+        total -= beds.pop(name)["size"]
+        os.remove(os.path.join(bed_dir, name))
+
+
+def get_music_bed(music_paths, total_duration, cache_dir, max_mb=None, max_age_days=None):
+    bed_dir = os.path.join(cache_dir, "music_beds")
+    os.makedirs(bed_dir, exist_ok=True)
+    fingerprint = music_folder_fingerprint(music_paths)
+
+    with music_bed_lock:
+        index = load_music_bed_index(bed_dir)
+        candidates = [
+            (bed["duration"], name) for name, bed in index["beds"].items()
+            if bed["fingerprint"] == fingerprint and bed["duration"] >= total_duration
+            and os.path.exists(os.path.join(bed_dir, name))
+        ]
+        if candidates:
+            name = min(candidates)[1]
+            index["stats"]["hits"] += 1
+            print(f"Reusing cached music bed: {name}")
+        else:
+            name = f"{fingerprint}_{int(total_duration)}.mp3"
+            index["stats"]["misses"] += 1
+            bed_path = combine_and_loop_music(music_paths, total_duration, os.path.join(bed_dir, name))
+            if not bed_path:
+                save_music_bed_index(bed_dir, index)
+                return None
+            index["beds"][name] = {
+                "fingerprint": fingerprint,
+                "duration": probe(bed_path)["duration"],
+                "size": os.path.getsize(bed_path),
+            }
+
+        index["beds"][name]["last_used"] = time.time()
+        evict_music_beds(
+            bed_dir, index,
+            max_mb * 1024 * 1024 if max_mb else None,
+            max_age_days * 86400 if max_age_days else None,
+            keep=name
+        )
+        save_music_bed_index(bed_dir, index)
+        stats = index["stats"]
+        print(f"Music bed cache: {stats['hits']} hits, {stats['misses']} misses, {len(index['beds'])} beds stored")
+        return os.path.join(bed_dir, name)
+
+
+def export_music_bed(bed_path, total_duration, output_audio_path):
+    print(f"Exporting music bed {bed_path} truncated to {total_duration} seconds: {output_audio_path}")
+    cmd = [FFMPEG_PATH, '-i', bed_path, '-t', str(total_duration), '-c', 'copy', output_audio_path, '-y']
+    run_ffmpeg(cmd, "music", total_duration)
+    return output_audio_path
+
+
+def build_av_filter_args(vf_filters, bg_volume=None, music_input=None, audio_input=0, sample_filter=None, sample_split=0, map_streams=False):
+    print(f"Building filter arguments for video filters: {vf_filters} with music input: {music_input}")
+    if music_input is None and sample_filter is None and not map_streams:
+        args = ['-vf', ",".join(vf_filters)] if vf_filters else []
+        return args + ['-c:a', 'copy']
+
+    graph = []
+    video_map = '0:v:0'
+    if sample_filter:
+        # Frame samples branch off after geometry filters so they never contain the letterbox text.
+        graph.append(f"[0:v:0]{','.join(vf_filters[:sample_split] + ['split=2'])}[vmain][vsample]")
+        graph.append(f"[vmain]{','.join(vf_filters[sample_split:]) or 'null'}[v]")
+        graph.append(f"[vsample]{sample_filter}[samples]")
+        video_map = '[v]'
+    elif vf_filters:
+        graph.append(f"[0:v:0]{','.join(vf_filters)}[v]")
+        video_map = '[v]'
+
+    if music_input is None:
+        filter_args = ['-filter_complex', ";".join(graph)] if graph else []
+        return filter_args + ['-map', video_map, '-map', f'{audio_input}:a?', '-c:a', 'copy']
+    graph.append(
+        f"[{music_input}:a]volume={bg_volume}[a1];"
+        f"[{audio_input}:a][a1]amix=inputs=2:duration=first:dropout_transition=3[a]"
+    )
+    return ['-filter_complex', ";".join(graph), '-map', video_map, '-map', '[a]']
+
+
+def build_rendition_args(vf_filters, renditions, bg_volume=None, music_input=None, sample_filter=None, sample_split=0):
+    print(f"Building filter arguments for {len(renditions)} renditions from one decode")
+    graph = []
+    source, shared_filters = '[0:v:0]', vf_filters
+    if sample_filter:
+        graph.append(f"[0:v:0]{','.join(vf_filters[:sample_split] + ['split=2'])}[vmain][vsample]")
+        graph.append(f"[vsample]{sample_filter}[samples]")
+        source, shared_filters = '[vmain]', vf_filters[sample_split:]
+    # Transpose and letterbox run once, then each rendition only scales its copy of the frames.
+    graph.append(f"{source}{','.join(shared_filters + [f'split={len(renditions)}'])}" + "".join(f"[r{i}]" for i in range(len(renditions))))
+    for index, rendition in enumerate(renditions):
+        graph.append(f"[r{index}]scale={rendition['width']}:{rendition['height']},setsar=1[v{index}]")
+
+    if music_input is None:
+        audio_args = [['-map', '0:a?', '-c:a', 'copy'] for _ in renditions]
+    else:
+        graph.append(
+            f"[{music_input}:a]volume={bg_volume}[a1];"
+            f"[0:a][a1]amix=inputs=2:duration=first:dropout_transition=3,asplit={len(renditions)}"
+            + "".join(f"[a{i}]" for i in range(len(renditions)))
+        )
+        audio_args = [['-map', f'[a{i}]'] for i in range(len(renditions))]
+    return ['-filter_complex', ";".join(graph)], [['-map', f'[v{i}]'] + audio_args[i] for i in range(len(renditions))]
+
+
+def parse_renditions(value):
+    renditions = []
+    for item in filter(None, (entry.strip() for entry in value.split(","))):
+        width, _, height = item.lower().partition("x")
+        try:
+            renditions.append({"label": item, "width": int(width), "height": int(height)})
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Rendition '{item}' is not WIDTHxHEIGHT")
+    return renditions
 
 
 def parse_style_arg(style_str):
@@ -98,6 +777,42 @@ def parse_style_arg(style_str):
     return result
 
 
+@functools.lru_cache(maxsize=64)
+def load_thread_font(font_family, font_size, thread_id):
+    print(f"Loading font {font_family} at size {font_size}")
+    try:
+        return ImageFont.truetype(font_family, font_size)
+    except:
+        return ImageFont.load_default()
+
+
+def load_font(font_family, font_size):
+    # FreeType faces are not safe to share between threads, so each worker gets its own copy.
+    return load_thread_font(font_family, font_size, threading.get_ident())
+
+
+@functools.lru_cache(maxsize=8)
+def thumbnail_background(size, bg_color):
+    return Image.new("RGB", size, bg_color)
+
+
+def output_geometry(resolution, rotation=0, transpose=None):
+    width, height = resolution
+    if abs(rotation) % 180 == 90:
+        width, height = height, width
+    if transpose is not None:
+        width, height = height, width
+    return (width, height)
+
+
+def capped_size(size, max_size):
+    width, height = size
+    if not max_size or max(width, height) <= max_size:
+        return (width, height)
+    scale = max_size / max(width, height)
+    return (max(1, round(width * scale)), max(1, round(height * scale)))
+
+
 def create_thumbnail(text, output_path, size, font_settings):
     print(f"Creating thumbnail with text: '{text}' at {output_path} with size {size} and font settings {font_settings}")
     bg_color = font_settings.get("bg_color", "0x000000").replace("0x", "#")
@@ -105,13 +820,9 @@ def create_thumbnail(text, output_path, size, font_settings):
     font_size = int(font_settings.get("size", 40))
     font_family = font_settings.get("family", "arial.ttf")
 
-    img = Image.new("RGB", size, bg_color)
+    img = thumbnail_background(tuple(size), bg_color).copy()
     draw = ImageDraw.Draw(img)
-
-    try:
-        font = ImageFont.truetype(font_family, font_size)
-    except:
-        font = ImageFont.load_default()
+    font = load_font(font_family, font_size)
 
     bbox = draw.textbbox((0, 0), text, font=font)
     text_width = bbox[2] - bbox[0]
@@ -122,26 +833,71 @@ def create_thumbnail(text, output_path, size, font_settings):
     img.save(output_path)
 
 
+def create_frame_thumbnail(text, frame_path, output_path, font_settings):
+    print(f"Compositing thumbnail text '{text}' onto frame {frame_path}")
+    bg_color = font_settings.get("bg_color", "0x000000").replace("0x", "#")
+    text_color = font_settings.get("color", "0xFFFFFF").replace("0x", "#")
+    font = load_font(font_settings.get("family", "arial.ttf"), int(font_settings.get("size", 40)))
+
+    with Image.open(frame_path) as frame:
+        img = frame.convert("RGB")
+    draw = ImageDraw.Draw(img)
+    bbox = draw.textbbox((0, 0), text, font=font)
+    text_width = bbox[2] - bbox[0]
+    text_height = bbox[3] - bbox[1]
+    position = ((img.width - text_width) // 2, (img.height - text_height) // 2)
+
+    padding = max(8, text_height // 2)
+    draw.rectangle(
+        (position[0] - padding, position[1] - padding, position[0] + text_width + padding, position[1] + text_height + padding),
+        fill=bg_color
+    )
+    draw.text(position, text, fill=text_color, font=font)
+    img.save(output_path)
+
+
+def score_frames(frames):
+    luma = frames.astype(np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    laplacian = (
+        4 * luma[:, 1:-1, 1:-1]
+        - luma[:, :-2, 1:-1] - luma[:, 2:, 1:-1]
+        - luma[:, 1:-1, :-2] - luma[:, 1:-1, 2:]
+    )
+    flat = luma.reshape(len(luma), -1)
+    sharpness = laplacian.reshape(len(laplacian), -1).var(axis=1)
+    low, high = np.percentile(flat, [5, 95], axis=1)
+    spread = high - low
+    black = (flat.mean(axis=1) < 16) | (spread < 10)
+    scores = np.log1p(sharpness) * spread
+    scores[black] = -np.inf
+    return scores
+
+
+def attached_pic_args(input_index):
+    return ['-map', f'{input_index}:v:0', '-c:v:1', 'copy', '-disposition:v:1', 'attached_pic']
+
+
 def add_thumbnail_to_video(video_path, thumbnail_path, output_path):
     print(f"Adding thumbnail {thumbnail_path} to video {video_path} as attached picture")
     cmd = [
         FFMPEG_PATH,
         '-i', video_path,
         '-i', thumbnail_path,
-        '-map', '0',
-        '-map', '1',
+        '-map', '0:V',
+        '-map', '0:a?',
         '-c', 'copy',
-        '-disposition:v:1', 'attached_pic',
+    ] + attached_pic_args(1) + [
         output_path,
         '-y'
     ]
-    subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return run_ffmpeg(cmd, "thumbnail")
 
 
-def build_drawtext_filter(top_text, bottom_text, top_font, bottom_font):
+def build_drawtext_filter(top_text, bottom_text, top_font, bottom_font, enable=None):
     print(f"Building drawtext filter for top: '{top_text}' and bottom: '{bottom_text}'")
     filters = []
-    duration = 5
+    duration = LETTERBOX_TEXT_SECONDS
+    enable = enable or f"lt(t\\,{duration})"
 
     def text_filter(text, y_pos, font):
         if not text:
@@ -151,7 +907,7 @@ def build_drawtext_filter(top_text, bottom_text, top_font, bottom_font):
         family = font.get("family", "arial.ttf")
         return (
             f"drawtext=text='{text}':fontfile='{family}':fontsize={size}:fontcolor={color}:"
-            f"x=(w-text_w)/2:y={y_pos}:enable='lt(t\,{duration})'"
+            f"x=(w-text_w)/2:y={y_pos}:enable='{enable}'"
         )
 
     if top_text:
@@ -165,137 +921,951 @@ def build_drawtext_filter(top_text, bottom_text, top_font, bottom_font):
 
 def get_video_resolution(video_path):
     print(f"Getting video resolution for: {video_path}")
+    info = probe(video_path)
+    return (info["width"], info["height"])
+
+
+def plan_parts(duration, clip_length):
+    print(f"Planning parts for duration: {duration} seconds with clip length: {clip_length} seconds")
+    parts = []
+    start = 0
+    while start < duration:
+        parts.append({"part_num": len(parts) + 1, "start": start, "length": min(clip_length, duration - start), "mode": "encode"})
+        start += clip_length
+    return parts
+
+
+def nearest_keyframe(keyframes, target, tolerance):
+    index = bisect.bisect_left(keyframes, target)
+    candidates = [kf for kf in keyframes[max(0, index - 1):index + 1] if abs(kf - target) <= tolerance]
+    return min(candidates, key=lambda kf: abs(kf - target)) if candidates else None
+
+
+def plan_cuts(duration, clip_length, keyframes, offset=0, tolerance=None):
+    tolerance = clip_length / 10 if tolerance is None else tolerance
+    print(f"Planning keyframe-aligned cuts with a tolerance of {tolerance} seconds over {len(keyframes)} keyframes")
+    window_end = offset + duration
+
+    # The first part always starts at the trim start so nothing before the first snapped cut is lost;
+    # it is only stream copied when the trim start itself is a keyframe
+    boundaries = [(offset, nearest_keyframe(keyframes, offset, 0.001) is not None)]
+    for part in plan_parts(duration, clip_length)[1:]:
+        target = offset + part["start"]
+        keyframe = nearest_keyframe(keyframes, target, tolerance)
+        previous = boundaries[-1][0]
+        if keyframe is None or keyframe <= previous or keyframe >= window_end:
+            boundaries.append((target, False))
+        else:
+            boundaries.append((keyframe, True))
+
+    parts = []
+    for index, (start, on_keyframe) in enumerate(boundaries):
+        end = boundaries[index + 1][0] if index + 1 < len(boundaries) else window_end
+        parts.append({
+            "part_num": index + 1,
+            "start": start - offset,
+            "length": end - start,
+            "mode": "copy" if on_keyframe else "encode",
+        })
+    return parts
+
+
+def plan_smart_heads(parts, keyframes, offset):
+    print(f"Planning smart re-encode heads for {len(parts)} parts")
+    for part in parts:
+        start = offset + part["start"]
+        index = bisect.bisect_left(keyframes, start + LETTERBOX_TEXT_SECONDS)
+        if index < len(keyframes) and keyframes[index] < start + part["length"]:
+            part["mode"] = "smart"
+            part["head_length"] = keyframes[index] - start
+    return parts
+
+
+def read_video_stream_params(video_path):
     cmd = [
         FFPROBE_PATH, '-v', 'error',
         '-select_streams', 'v:0',
-        '-show_entries', 'stream=width,height',
+        '-show_entries', f"stream={','.join(SMART_STREAM_PARAMS)}",
         '-of', 'json',
         video_path
     ]
-    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    info = json.loads(result.stdout)
-    w = info['streams'][0]['width']
-    h = info['streams'][0]['height']
-    return (w, h)
+    _, stdout = run_ffprobe(cmd)
+    streams = json.loads(stdout or '{}').get('streams', [])
+    return {key: streams[0].get(key) for key in SMART_STREAM_PARAMS} if streams else None
 
 
-def split_video_fast(args):
-    print("Starting video split process...")
+def decode_video(video_path, start=None, length=None):
+    cmd = [FFMPEG_PATH, '-v', 'error', '-xerror']
+    if start is not None:
+        cmd += ['-ss', str(start)]
+    cmd += ['-i', video_path]
+    if length is not None:
+        cmd += ['-t', str(length)]
+    cmd += ['-map', '0:V:0', '-f', 'null', '-']
+    returncode, _, stderr_tail = run_child(cmd, "ffmpeg decode")
+    if returncode != 0 or stderr_tail.strip():
+        print(f"Decoding {video_path} failed:\n{stderr_tail}")
+        return False
+    return True
+
+
+def verify_smart_join(video_path, expected_length, join_time=None):
+    print(f"Verifying smart join: {video_path}")
+    cmd = [
+        FFPROBE_PATH, '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=dts_time:format=duration',
+        '-of', 'json',
+        video_path
+    ]
+    _, stdout = run_ffprobe(cmd)
+    try:
+        info = json.loads(stdout)
+        duration = float(info['format']['duration'])
+    except (KeyError, ValueError):
+        return False
+    dts = [float(p['dts_time']) for p in info.get('packets', []) if p.get('dts_time') not in (None, 'N/A')]
+    monotonic = all(b > a for a, b in zip(dts, dts[1:]))
+    if not (dts and monotonic and abs(duration - expected_length) <= 1.0):
+        return False
+    # The copied tail keeps the source's parameter sets, so decode across the join to prove the head's still apply
+    if join_time is not None:
+        return decode_video(video_path, max(0, join_time - JOIN_DECODE_SECONDS), 2 * JOIN_DECODE_SECONDS)
+    return True
+
+
+def smart_encoder_args(video_stream):
+    encoder, bitstream_filter = SMART_ENCODERS[video_stream["codec_name"]]
+    encoder_args = ['-c:v', encoder, '-pix_fmt', video_stream["pix_fmt"]]
+    profile = SMART_PROFILES[encoder].get(video_stream.get("profile"))
+    if profile:
+        encoder_args += ['-profile:v', profile]
+    if encoder == "libx264" and video_stream.get("level", -99) > 0:
+        encoder_args += ['-level', str(video_stream["level"] / 10)]
+    return encoder_args, bitstream_filter
+
+
+def encode_smart_part(part, context, drawtext_filter, video_file, cover_path=None):
+    args = context["args"]
+    input_path = context["input_path"]
+    start = context["offset"] + part["start"]
+    head_length = part["head_length"]
+    encoder_args, bitstream_filter = smart_encoder_args(context["video_stream"])
+    thread_args = ['-threads', str(context["threads"])] if context["threads"] else []
+
+    head_path = scratch.path(f"part{part['part_num']}_head.ts")
+    head_cmd = [
+        FFMPEG_PATH, '-ss', str(start), '-i', input_path, '-t', str(head_length),
+        '-an', '-vf', drawtext_filter
+    ] + encoder_args + thread_args + ['-bsf:v', bitstream_filter, '-f', 'mpegts', head_path, '-y']
+    tail_cmd = [
+        FFMPEG_PATH, '-v', 'error', '-ss', str(start + head_length), '-i', input_path, '-t', str(part["length"] - head_length),
+        '-an', '-c:v', 'copy', '-bsf:v', bitstream_filter,
+        '-output_ts_offset', str(head_length), '-f', 'mpegts', 'pipe:1'
+    ]
+    print(f"Encoding {head_length:.3f}s head and streaming the copied tail for: {video_file}")
+    try:
+        run_ffmpeg(head_cmd, "smart_head", head_length)
+        scratch.track(head_path)
+
+        # The tail is a stream copy of the source, so the head only has to match the already probed source parameters.
+        head_params = read_video_stream_params(head_path)
+        source_params = {key: context["video_stream"].get(key) for key in SMART_STREAM_PARAMS}
+        if not head_params or head_params != source_params:
+            print(f"Head and source codec parameters differ ({head_params} vs {source_params}), falling back to a full encode")
+            return False
+
+        join_cmd = [FFMPEG_PATH, '-f', 'mpegts', '-i', 'pipe:0', '-ss', str(start), '-i', input_path]
+        cover_input = 2
+        if context["music_path"]:
+            join_cmd += ['-ss', str(part["start"]), '-i', context["music_path"]]
+            cover_input = 3
+        if cover_path:
+            join_cmd += ['-i', cover_path]
+        if context["music_path"]:
+            join_cmd += build_av_filter_args([], args.bg_volume, music_input=2, audio_input=1)
+        else:
+            join_cmd += ['-map', '0:v:0', '-map', '1:a?', '-c:a', 'copy']
+        if cover_path:
+            join_cmd += attached_pic_args(cover_input)
+        join_cmd += ['-t', str(part["length"]), '-c:v', 'copy', '-avoid_negative_ts', 'make_zero', video_file, '-y']
+
+        with profiler.span("ffmpeg smart_tail", "subprocess", command=os.path.basename(FFMPEG_PATH)) as metrics:
+            tail_process = subprocess.Popen(tail_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+            def feed(sink):
+                # Annex B MPEG-TS can be joined byte-wise, so the head file and the tail stream go in back to back.
+                try:
+                    with open(head_path, 'rb') as head:
+                        shutil.copyfileobj(head, sink.buffer)
+                    shutil.copyfileobj(tail_process.stdout, sink.buffer, 1024 * 1024)
+                except OSError:
+                    pass
+                finally:
+                    with contextlib.suppress(OSError):
+                        sink.close()
+                    tail_process.stdout.close()
+
+            returncode = run_ffmpeg(join_cmd, "encode", part["length"], name=os.path.basename(video_file), feed=feed)
+            metrics["returncode"] = wait_child(tail_process, metrics)
+        if returncode != 0 or metrics["returncode"] != 0:
+            print(f"Streaming the smart tail failed for {video_file}, falling back to a full encode")
+            return False
+    finally:
+        scratch.release(head_path)
+
+    if not verify_smart_join(video_file, part["length"], head_length):
+        print(f"Smart join verification failed for {video_file}, falling back to a full encode")
+        return False
+    return True
+
+
+def report_parts(parts, offset):
+    for part in parts:
+        start = offset + part["start"]
+        print(f"Part {part['part_num']}: {part['mode']} {start:.3f}s - {start + part['length']:.3f}s")
+
+
+def threads_per_job(jobs):
+    return max(1, (os.cpu_count() or 1) // jobs)
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def partial_path(path):
+    name, ext = os.path.splitext(path)
+    return f"{name}.partial{ext}"
+
+
+def manifest_path(output_folder, original_file_name):
+    return os.path.join(output_folder, f"{original_file_name}.manifest.json")
+
+
+def resolved_options(args, offset, duration, music_fingerprint):
+    return {
+        "offset": offset,
+        "duration": duration,
+        "clip_length": args.clip_length,
+        "video_naming_convention": args.video_naming_convention,
+        "letterbox_setting": args.letterbox_setting,
+        "letterbox_top_font": args.letterbox_top_font,
+        "letterbox_bottom_font": args.letterbox_bottom_font,
+        "video_transpose": args.video_transpose,
+        "music": music_fingerprint,
+        "bg_volume": args.bg_volume,
+        "engine": args.engine,
+        "smart_encode": args.smart_encode,
+        "keyframe_tolerance": args.keyframe_tolerance,
+        "renditions": args.renditions,
+        "embed_thumbnail": args.embed_thumbnail,
+    }
+
+
+def load_manifest(path, input_fingerprint, options):
+    if os.path.exists(path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get("input") == input_fingerprint and manifest.get("options") == options:
+                print(f"Resuming from manifest: {path}")
+                return manifest
+            print(f"Manifest {path} belongs to a different input or options, starting over")
+        except (OSError, ValueError):
+            print(f"Ignoring unreadable manifest: {path}")
+    return {"input": input_fingerprint, "options": options, "parts": {}}
+
+
+def save_manifest(context):
+    with context["manifest_lock"]:
+        path = context["manifest_path"]
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(context["manifest"], f, indent=2)
+        os.replace(path + ".tmp", path)
+
+
+def manifest_entry(context, part_num):
+    with context["manifest_lock"]:
+        return dict(context["manifest"]["parts"].get(str(part_num), {}))
+
+
+def update_manifest_entry(context, part_num, **values):
+    with context["manifest_lock"]:
+        context["manifest"]["parts"].setdefault(str(part_num), {}).update(values)
+    save_manifest(context)
+
+
+def part_is_complete(entry, part, video_file, rendition_files=()):
+    if entry.get("status") != "done" or not os.path.exists(video_file):
+        return False
+    if entry.get("start") != part["start"] or entry.get("length") != part["length"]:
+        return False
+    for rendition_file in rendition_files:
+        recorded = entry.get("renditions", {}).get(os.path.basename(rendition_file), {})
+        if not os.path.exists(rendition_file) or os.path.getsize(rendition_file) != recorded.get("size"):
+            return False
+        if file_checksum(rendition_file) != recorded.get("sha256"):
+            return False
+    return os.path.getsize(video_file) == entry.get("size") and file_checksum(video_file) == entry.get("sha256")
+
+
+def thumbnail_is_current(entry, thumb_path, thumbnail_key):
+    return os.path.exists(thumb_path) and entry.get("thumbnail_key") == thumbnail_key
+
+
+def record_part(context, part, video_file, rendition_files=(), cover_key=None):
+    renditions = {
+        os.path.basename(rendition_file): {"size": os.path.getsize(rendition_file), "sha256": file_checksum(rendition_file)}
+        for rendition_file in rendition_files
+    }
+    update_manifest_entry(
+        context, part["part_num"],
+        status="done", mode=part["mode"], start=part["start"], length=part["length"],
+        file=os.path.basename(video_file), size=os.path.getsize(video_file), sha256=file_checksum(video_file),
+        renditions=renditions, cover_key=cover_key
+    )
+
+
+def embed_cover(context, part, video_files, thumb_path):
+    if not os.path.exists(thumb_path):
+        return
+    print(f"Remuxing part {part['part_num']} to attach its thumbnail as cover art")
+    for video_file in video_files:
+        temp_video = partial_path(video_file)
+        if add_thumbnail_to_video(video_file, thumb_path, temp_video) == 0:
+            os.replace(temp_video, video_file)
+        else:
+            # Leave the cover unrecorded so the next run tries again
+            if os.path.exists(temp_video):
+                os.remove(temp_video)
+            return
+    record_part(context, part, video_files[0], video_files[1:], cover_key=context["thumbnail_key"])
+
+
+def render_part_thumbnail(context, part_num, video_name, thumb_path, entry):
+    if thumbnail_is_current(entry, thumb_path, context["thumbnail_key"]):
+        return
+    with profiler.span("create_thumbnail", part=part_num):
+        temp_thumb = partial_path(thumb_path)
+        create_thumbnail(video_name, temp_thumb, context["thumbnail_size"], context["thumbnail_font"])
+        os.replace(temp_thumb, thumb_path)
+    update_manifest_entry(context, part_num, thumbnail=os.path.basename(thumb_path), thumbnail_key=context["thumbnail_key"])
+
+
+def sample_part_frames(part, context, sample_path):
+    args = context["args"]
+    start = context["offset"] + part["start"]
+    width, height = context["sample_size"]
+    geometry = [f"transpose={args.video_transpose}"] if args.video_transpose is not None else []
+    cmd = [FFMPEG_PATH]
+    if context["keyframes"] is not None:
+        cmd += ['-skip_frame', 'nokey']
+        sample_filter = geometry + [f"scale={width}:{height}", "format=rgb24"]
+    else:
+        sample_filter = geometry + [f"fps={args.thumbnail_samples}/{part['length']}", f"scale={width}:{height}", "format=rgb24"]
+    cmd += [
+        '-ss', str(start), '-i', context["input_path"], '-t', str(part["length"]),
+        '-an', '-vf', ",".join(sample_filter), '-fps_mode', 'passthrough',
+        '-f', 'rawvideo', sample_path, '-y'
+    ]
+    run_ffmpeg(cmd, "frame_samples", part["length"])
+    if context["keyframes"] is not None:
+        return [kf for kf in context["keyframes"] if start <= kf < start + part["length"]]
+    return None
+
+
+def render_frame_thumbnail(part, context, video_name, thumb_path, sample_path):
+    args = context["args"]
+    part_num = part["part_num"]
+    start = context["offset"] + part["start"]
+    width, height = context["sample_size"]
+    started = time.perf_counter()
+
+    with profiler.span("frame_thumbnail", part=part_num) as metrics:
+        timestamps = None
+        if not os.path.exists(sample_path) or not os.path.getsize(sample_path):
+            timestamps = sample_part_frames(part, context, sample_path)
+        scratch.track(sample_path)
+        frames = np.fromfile(sample_path, dtype=np.uint8)
+        scratch.release(sample_path)
+        frames = frames[:len(frames) - len(frames) % (width * height * 3)].reshape(-1, height, width, 3)
+        if not len(frames):
+            print(f"No frames sampled for part {part_num}, using a text thumbnail")
+            create_thumbnail(video_name, partial_path(thumb_path), context["thumbnail_size"], context["thumbnail_font"])
+            os.replace(partial_path(thumb_path), thumb_path)
+            return
+
+        if timestamps is None or len(timestamps) != len(frames):
+            timestamps = [start + index * part["length"] / len(frames) for index in range(len(frames))]
+        if len(frames) > args.thumbnail_samples:
+            chosen = np.linspace(0, len(frames) - 1, args.thumbnail_samples).round().astype(int)
+            frames = frames[chosen]
+            timestamps = [timestamps[index] for index in chosen]
+        scores = score_frames(frames)
+        winner = int(np.argmax(scores))
+        scored = time.perf_counter()
+
+        frame_path = scratch.path(f"part{part_num}_frame.jpg")
+        thumb_width, thumb_height = context["thumbnail_size"]
+        geometry = [f"transpose={args.video_transpose}"] if args.video_transpose is not None else []
+        grab_cmd = [
+            FFMPEG_PATH, '-ss', str(timestamps[winner]), '-i', context["input_path"],
+            '-frames:v', '1', '-vf', ",".join(geometry + [f"scale={thumb_width}:{thumb_height}"]),
+            frame_path, '-y'
+        ]
+        run_ffmpeg(grab_cmd, "frame_grab")
+        scratch.track(frame_path)
+        create_frame_thumbnail(video_name, frame_path, partial_path(thumb_path), context["thumbnail_font"])
+        scratch.release(frame_path)
+        os.replace(partial_path(thumb_path), thumb_path)
+
+        metrics.update(samples=len(frames), sample_bytes=int(frames.nbytes), winner_time=timestamps[winner])
+    print(
+        f"Frame thumbnail for part {part_num}: {len(frames)} samples ({frames.nbytes / 1024:.0f} KB) scored in "
+        f"{(scored - started) * 1000:.0f} ms, frame at {timestamps[winner]:.2f}s, total {time.perf_counter() - started:.2f}s"
+    )
+
+
+def render_thumbnails(job, workers=1):
+    context = job["context"]
+    if context["args"].thumbnail_mode == "frame":
+        print("Frame thumbnails are rendered after each part is encoded")
+        return
+    print(f"Rendering {len(job['parts'])} thumbnails at {context['thumbnail_size']} with {workers} workers")
+
+    def render(part):
+        part_num = part["part_num"]
+        video_name, _, thumb_path, _ = part_paths(part_num, context)
+        render_part_thumbnail(context, part_num, video_name, thumb_path, manifest_entry(context, part_num))
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(render, job["parts"]))
+    else:
+        for part in job["parts"]:
+            render(part)
+
+
+def part_paths(part_num, context, rendition=None):
+    args = context["args"]
+    renditions = context["renditions"]
+    rendition = rendition or (renditions[0]["label"] if renditions else "")
+    video_name = args.video_naming_convention.replace("..part", str(part_num)).replace("..rendition", rendition)
+    thumbnail_name = args.thumbnail_naming_convention.replace("..part", str(part_num))
+    video_file = os.path.join(args.output_folder, f"{video_name}{context['original_ext']}")
+    thumb_path = os.path.join(args.output_folder, f"{thumbnail_name}.jpg")
+    final_output = os.path.join(args.output_folder, f"{video_name}_with_thumb{context['original_ext']}")
+    return video_name, video_file, thumb_path, final_output
+
+
+def process_part(part, context):
+    args = context["args"]
+    part_num = part["part_num"]
+    original_file_name = context["original_file_name"]
+    video_name, video_file, thumb_path, final_output = part_paths(part_num, context)
+    entry = manifest_entry(context, part_num)
+
+    letterbox_settings = context["letterbox_settings"]
+    top_text = letterbox_settings.get("top", "").replace("..part", str(part_num)).replace("..input", original_file_name)
+    bottom_text = letterbox_settings.get("bottom", "").replace("..part", str(part_num)).replace("..input", original_file_name)
+    drawtext_filter = build_drawtext_filter(top_text, bottom_text, context["letterbox_top_font"], context["letterbox_bottom_font"])
+
+    vf_filters = [f"transpose={args.video_transpose}"] if args.video_transpose is not None else []
+    if drawtext_filter:
+        vf_filters.append(drawtext_filter)
+
+    frame_thumbnail = args.thumbnail_mode == "frame" and not thumbnail_is_current(entry, thumb_path, context["thumbnail_key"])
+    sample_path = scratch.path(f"part{part_num}_samples.rgb")
+    rendition_files = [part_paths(part_num, context, rendition["label"])[1] for rendition in context["renditions"][1:]]
+
+    if part_is_complete(entry, part, video_file, rendition_files):
+        print(f"Skipping completed part: {video_file}")
+        part["mode"] = entry.get("mode", part["mode"])
+    else:
+        temp_video = partial_path(video_file)
+        temp_renditions = [partial_path(rendition_file) for rendition_file in rendition_files]
+        # Text thumbnails already exist before the encode, so they ride along as a second input instead of a remux.
+        cover_path = thumb_path if args.embed_thumbnail and args.thumbnail_mode == "text" and os.path.exists(thumb_path) else None
+        with profiler.span("encode_part", part=part_num) as metrics:
+            if part["mode"] == "smart" and not encode_smart_part(part, context, drawtext_filter, temp_video, cover_path):
+                part["mode"] = "encode"
+            succeeded = part["mode"] == "smart" or encode_part(
+                part, context, vf_filters, temp_video, sample_path if frame_thumbnail else None, temp_renditions, cover_path
+            )
+            metrics["mode"] = part["mode"]
+        if succeeded and all(os.path.exists(path) for path in [temp_video] + temp_renditions):
+            os.replace(temp_video, video_file)
+            for temp_rendition, rendition_file in zip(temp_renditions, rendition_files):
+                os.replace(temp_rendition, rendition_file)
+            record_part(context, part, video_file, rendition_files, context["thumbnail_key"] if cover_path else None)
+        else:
+            for path in [temp_video] + temp_renditions:
+                if os.path.exists(path):
+                    os.remove(path)
+            update_manifest_entry(context, part_num, status="failed")
+            print(f"Failed to encode part: {video_file}")
+
+    if frame_thumbnail and os.path.exists(video_file):
+        render_frame_thumbnail(part, context, video_name, thumb_path, sample_path)
+        update_manifest_entry(context, part_num, thumbnail=os.path.basename(thumb_path), thumbnail_key=context["thumbnail_key"])
+
+    entry = manifest_entry(context, part_num)
+    if args.embed_thumbnail and entry.get("status") == "done" and entry.get("cover_key") != context["thumbnail_key"]:
+        embed_cover(context, part, [video_file] + rendition_files, thumb_path)
+
+    return [video_file, thumb_path, final_output] + rendition_files
+
+
+def encode_part(part, context, vf_filters, video_file, sample_path=None, rendition_files=(), cover_path=None):
+    args = context["args"]
+    split_cmd = [FFMPEG_PATH, '-ss', str(context["offset"] + part["start"]), '-i', context["input_path"]]
+    music_input = None
+    if context["music_path"]:
+        split_cmd += ['-ss', str(part["start"]), '-i', context["music_path"]]
+        music_input = 1
+    cover_args = []
+    if cover_path:
+        cover_args = attached_pic_args(2 if music_input else 1)
+        split_cmd += ['-i', cover_path]
+    sample_filter = None
+    if sample_path and part["mode"] == "encode":
+        width, height = context["sample_size"]
+        sample_filter = f"fps={args.thumbnail_samples}/{part['length']},scale={width}:{height},format=rgb24"
+    sample_split = 1 if args.video_transpose is not None else 0
+    output_args = ['-avoid_negative_ts', 'make_zero']
+    if context["threads"]:
+        output_args += ['-threads', str(context["threads"])]
+
+    if context["renditions"]:
+        graph_args, rendition_maps = build_rendition_args(
+            vf_filters, context["renditions"], args.bg_volume, music_input, sample_filter, sample_split
+        )
+        split_cmd += graph_args
+        for map_args, output_file in zip(rendition_maps, [video_file] + list(rendition_files)):
+            split_cmd += map_args + cover_args + ['-t', str(part["length"])] + output_args + [output_file]
+    else:
+        split_cmd += ['-t', str(part["length"])]
+        split_cmd += build_av_filter_args(
+            vf_filters, args.bg_volume, music_input, sample_filter=sample_filter, sample_split=sample_split,
+            map_streams=bool(cover_path)
+        )
+        if part["mode"] == "copy":
+            split_cmd += ['-c:v', 'copy']
+        split_cmd += cover_args + output_args + [video_file]
+    if sample_filter:
+        split_cmd += ['-map', '[samples]', '-t', str(part["length"]), '-f', 'rawvideo', sample_path]
+    split_cmd += ['-y']
+
+    print(f"Splitting video ({part['mode']}): {video_file}")
+    return run_ffmpeg(split_cmd, "encode", part["length"], name=os.path.basename(video_file)) == 0
+
+
+def segment_output_pattern(naming_convention, original_ext):
+    return naming_convention.replace("%", "%%").replace("..part", "%d") + original_ext
+
+
+def split_video_segmented(parts, context):
+    args = context["args"]
+    clip_length = args.clip_length
+    original_file_name = context["original_file_name"]
+    print(f"Splitting {len(parts)} parts from a single decode of {context['input_path']}")
+
+    part_expr = f"%{{eif\\:trunc(t/{clip_length})+1\\:d}}"
+    letterbox_settings = context["letterbox_settings"]
+    top_text = letterbox_settings.get("top", "").replace("..part", part_expr).replace("..input", original_file_name)
+    bottom_text = letterbox_settings.get("bottom", "").replace("..part", part_expr).replace("..input", original_file_name)
+    drawtext_filter = build_drawtext_filter(
+        top_text, bottom_text, context["letterbox_top_font"], context["letterbox_bottom_font"],
+        enable=f"lt(mod(t\\,{clip_length})\\,{LETTERBOX_TEXT_SECONDS})"
+    )
+
+    vf_filters = [f"transpose={args.video_transpose}"] if args.video_transpose is not None else []
+    if drawtext_filter:
+        vf_filters.append(drawtext_filter)
+
+    output_pattern = os.path.join(args.output_folder, segment_output_pattern(args.video_naming_convention, context["original_ext"]))
+    segment_cmd = [FFMPEG_PATH, '-ss', str(context["offset"]), '-t', str(context["duration"]), '-i', context["input_path"]]
+    if context["music_path"]:
+        segment_cmd += ['-i', context["music_path"]]
+        segment_cmd += build_av_filter_args(vf_filters, args.bg_volume, 1)
+    else:
+        segment_cmd += ['-map', '0:v:0', '-map', '0:a?'] + build_av_filter_args(vf_filters)
+    if vf_filters:
+        segment_cmd += ['-force_key_frames', f"expr:gte(t,n_forced*{clip_length})"]
+    else:
+        segment_cmd += ['-c:v', 'copy']
+    segment_cmd += [
+        '-avoid_negative_ts', 'make_zero',
+        '-f', 'segment', '-segment_time', str(clip_length),
+        '-segment_start_number', '1', '-reset_timestamps', '1',
+        output_pattern, '-y'
+    ]
+
+    complete = all(
+        part_is_complete(manifest_entry(context, part["part_num"]), part, part_paths(part["part_num"], context)[1])
+        for part in parts
+    )
+    if complete:
+        print(f"All {len(parts)} segments are already complete, skipping the segment pass")
+    else:
+        print(f"Segmenting video: {output_pattern}")
+        with profiler.span("segment", parts=len(parts)):
+            returncode = run_ffmpeg(segment_cmd, "segment", context["duration"])
+
+    generated_files = []
+    for part in parts:
+        part_num = part["part_num"]
+        _, video_file, thumb_path, _ = part_paths(part_num, context)
+        if not complete:
+            if returncode == 0 and os.path.exists(video_file):
+                record_part(context, part, video_file)
+            else:
+                update_manifest_entry(context, part_num, status="failed")
+        entry = manifest_entry(context, part_num)
+        if args.embed_thumbnail and entry.get("status") == "done" and entry.get("cover_key") != context["thumbnail_key"]:
+            embed_cover(context, part, [video_file], thumb_path)
+        generated_files += [video_file, thumb_path]
+    return generated_files
+
+
+def prepare_split(args, threads=None):
+    print(f"Preparing video split for: {args.input}")
     input_path = args.input
     if not os.path.exists(input_path):
         print("Video file not found.")
-        return
+        return None
 
     os.makedirs(args.output_folder, exist_ok=True)
 
     original_file_name, original_ext = os.path.splitext(os.path.basename(input_path))
 
-    trim_start_sec = hms_to_seconds(args.trim_start)
-    trim_end_sec = hms_to_seconds(args.trim_end) if args.trim_end else None
-    trim_duration = trim_end_sec - trim_start_sec if trim_end_sec else None
-
-    trimmed_video_path = os.path.join(args.output_folder, f"{original_file_name}_trimmed{original_ext}")
-    trim_cmd = [FFMPEG_PATH, "-ss", args.trim_start, "-i", input_path]
-    if trim_duration:
-        trim_cmd += ["-t", str(trim_duration)]
-    trim_cmd += ["-c", "copy", trimmed_video_path, "-y"]
-    
-    print(f"Trimming video: {trimmed_video_path}")
-    subprocess.run(trim_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    input_path = trimmed_video_path
-
+    configure_probe_cache(args.cache_dir)
+    letterbox_settings = parse_style_arg(args.letterbox_setting)
+    has_letterbox_text = bool(letterbox_settings.get("top") or letterbox_settings.get("bottom"))
+    # Keyframes come from the same probe whenever part planning may snap cuts or smart encode heads
+    needs_keyframes = (
+        args.engine == "parts" and args.video_transpose is None and not args.renditions
+        and (args.smart_encode or not has_letterbox_text)
+    )
     print(f"Analyzing video duration for: {input_path}")
-    result = subprocess.run([
-        FFPROBE_PATH, '-v', 'error',
-        '-show_entries', 'format=duration',
-        '-of', 'json',
-        input_path
-    ], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-
     try:
-        duration = float(json.loads(result.stdout)['format']['duration'])
+        with profiler.span("probe_source"):
+            source_info = probe(input_path, keyframes=needs_keyframes)
+        source_duration = source_info["duration"]
+        resolution = (source_info["width"], source_info["height"])
     except:
         print("Failed to retrieve duration.")
-        return
+        return None
+
+    trim_start_sec = hms_to_seconds(args.trim_start)
+    trim_end_sec = hms_to_seconds(args.trim_end) if args.trim_end else source_duration
+    offset = trim_start_sec
+    duration = min(trim_end_sec, source_duration) - trim_start_sec
+    if duration <= 0:
+        print("Trim window is empty.")
+        return None
+    print(f"Using trim window {trim_start_sec}s - {trim_start_sec + duration}s ({duration} seconds)")
 
     music_generated = None
+    music_temporary = False
+    music_fingerprint = None
     if args.music_folder and os.path.exists(args.music_folder):
         music_files = get_music_files_from_directory(args.music_folder)
         if music_files:
-            combined_music_path = os.path.join(args.output_folder, f"{args.music_file_name or 'combined_music'}.mp3")
-            music_generated = combine_and_loop_music(music_files, duration, combined_music_path)
+            music_fingerprint = music_folder_fingerprint(music_files)
+            if args.music_file_name:
+                combined_music_path = os.path.join(args.output_folder, f"{args.music_file_name}.mp3")
+            else:
+                combined_music_path = scratch.path("combined_music.mp3")
+            with profiler.span("music_bed", tracks=len(music_files)):
+                if args.cache_dir:
+                    music_generated = get_music_bed(
+                        music_files, duration, args.cache_dir, args.music_cache_max_mb, args.music_cache_max_age_days
+                    )
+                    if music_generated and args.music_file_name:
+                        export_music_bed(music_generated, duration, combined_music_path)
+                else:
+                    music_generated = combine_and_loop_music(music_files, duration, combined_music_path)
+                    music_temporary = not args.music_file_name
+                    if music_generated and music_temporary:
+                        scratch.track(music_generated)
 
-            if music_generated:
-                audio_added_video = os.path.join(args.output_folder, f"{original_file_name}_with_music{original_ext}")
-                replace_video_audio(input_path, music_generated, audio_added_video, args.bg_volume)
-                input_path = audio_added_video
-
-    resolution = get_video_resolution(input_path)
     thumbnail_font = parse_style_arg(args.thumbnail_font)
-    letterbox_settings = parse_style_arg(args.letterbox_setting)
     letterbox_top_font = parse_style_arg(args.letterbox_top_font)
     letterbox_bottom_font = parse_style_arg(args.letterbox_bottom_font)
 
-    i = 0
-    start = 0
-    generated_files = []
+    renditions = args.renditions or []
+    if renditions and args.engine == "segment":
+        print("Renditions need the parts engine, writing a single rendition")
+        renditions = []
+    if renditions and "..rendition" not in args.video_naming_convention:
+        args.video_naming_convention += " ..rendition"
+        print(f"Naming renditions as: {args.video_naming_convention}")
 
-    while start < duration:
-        part_num = i + 1
-        video_name = args.video_naming_convention.replace("..part", str(part_num))
-        thumbnail_name = args.thumbnail_naming_convention.replace("..part", str(part_num))
-
-        video_file = os.path.join(args.output_folder, f"{video_name}{original_ext}")
-        thumb_path = os.path.join(args.output_folder, f"{thumbnail_name}.jpg")
-        final_output = os.path.join(args.output_folder, f"{video_name}_with_thumb{original_ext}")
-
-        top_text = letterbox_settings.get("top", "").replace("..part", str(part_num)).replace("..input", original_file_name)
-        bottom_text = letterbox_settings.get("bottom", "").replace("..part", str(part_num)).replace("..input", original_file_name)
-        drawtext_filter = build_drawtext_filter(top_text, bottom_text, letterbox_top_font, letterbox_bottom_font)
-
-        vf_filters = [f"transpose={args.video_transpose}"] if args.video_transpose is not None else []
-        if drawtext_filter:
-            vf_filters.append(drawtext_filter)
-
-        split_cmd = [
-            FFMPEG_PATH, '-ss', str(start), '-i', input_path, '-t', str(args.clip_length),
-            '-vf', ",".join(vf_filters),
-            '-c:a', 'copy', '-avoid_negative_ts', 'make_zero', video_file, '-y'
-        ]
-        
-        print(f"Splitting video: {video_file}")
-        subprocess.run(split_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    untransposed_parts = args.engine == "parts" and args.video_transpose is None and not renditions
+    smart_encode = (
+        untransposed_parts and has_letterbox_text and args.smart_encode
+        and source_info["video_codec"] in SMART_ENCODERS
+    )
+    with profiler.span("plan_parts"):
+        keyframes = None
+        if untransposed_parts and (smart_encode or not has_letterbox_text):
+            keyframes = [kf - source_info["start_time"] for kf in source_info["keyframes"]]
+        if smart_encode:
+            parts = plan_smart_heads(plan_parts(duration, args.clip_length), keyframes, offset)
+        elif untransposed_parts and not has_letterbox_text:
+            parts = plan_cuts(duration, args.clip_length, keyframes, offset, args.keyframe_tolerance)
+        else:
+            parts = plan_parts(duration, args.clip_length)
+    if threads is None and args.jobs > 1:
+        threads = threads_per_job(args.jobs)
+
+    options = resolved_options(args, offset, duration, music_fingerprint)
+    if args.thumbnail_mode == "frame" and (np is None or args.engine == "segment"):
+        print("Frame thumbnails need NumPy and the parts engine, using text thumbnails")
+        args.thumbnail_mode = "text"
+    output_size = output_geometry(resolution, source_info["rotation"], args.video_transpose)
+    if renditions and renditions[0]["width"] > 0 and renditions[0]["height"] > 0:
+        output_size = (renditions[0]["width"], renditions[0]["height"])
+    thumbnail_size = capped_size(output_size, args.thumbnail_max_size)
+    sample_size = tuple(2 * (side // 2) for side in capped_size(output_size, FRAME_SAMPLE_MAX_SIZE))
+    thumbnail_key = hashlib.sha1(json.dumps(
+        [args.thumbnail_naming_convention, thumbnail_font, thumbnail_size, args.thumbnail_mode], sort_keys=True
+    ).encode('utf-8')).hexdigest()
+    job_manifest_path = manifest_path(args.output_folder, original_file_name)
+
+    context = {
+        "manifest_path": job_manifest_path,
+        "manifest": load_manifest(job_manifest_path, file_fingerprint(input_path), options),
+        "manifest_lock": threading.Lock(),
+        "thumbnail_key": thumbnail_key,
+        "input_path": input_path,
+        "offset": offset,
+        "duration": duration,
+        "music_path": music_generated,
+        "original_file_name": original_file_name,
+        "original_ext": original_ext,
+        "args": args,
+        "thumbnail_size": thumbnail_size,
+        "sample_size": sample_size,
+        "keyframes": keyframes,
+        "renditions": renditions,
+        "video_stream": find_video_stream(source_info["streams"]),
+        "thumbnail_font": thumbnail_font,
+        "letterbox_settings": letterbox_settings,
+        "letterbox_top_font": letterbox_top_font,
+        "letterbox_bottom_font": letterbox_bottom_font,
+        "threads": threads,
+    }
 
-        create_thumbnail(video_name, thumb_path, resolution, thumbnail_font)
-        # add_thumbnail_to_video(video_file, thumb_path, final_output)
+    save_probe_cache()
+    return {
+        "context": context,
+        "parts": parts,
+        "music_temporary": music_temporary,
+        "generated_files": [],
+    }
 
-        generated_files += [video_file, thumb_path, final_output]
 
-        start += args.clip_length
-        i += 1
+def split_tasks(job):
+    if job["context"]["args"].engine == "segment":
+        return [lambda: split_video_segmented(job["parts"], job["context"])]
+    return [lambda part=part: process_part(part, job["context"]) for part in job["parts"]]
 
-    print(f"Video split into {i} parts.")
 
-    if os.path.exists(trimmed_video_path) and args.video_naming_convention:
-        os.remove(trimmed_video_path)
-    if music_generated and not args.music_file_name:
-        os.remove(music_generated)
+def finish_split(job):
+    context = job["context"]
+    args = context["args"]
+    parts = job["parts"]
+    if args.engine == "parts":
+        report_parts(parts, context["offset"])
+    print(f"Video split into {len(parts)} parts.")
+
+    if context["music_path"] and job["music_temporary"]:
+        scratch.release(context["music_path"])
     if not args.video_naming_convention:
-        for file in generated_files:
+        for file in job["generated_files"]:
             if os.path.exists(file):
                 os.remove(file)
+    return parts
 
 
-if __name__ == "__main__":
+def finish_run(args):
+    progress.summary()
+    save_probe_cache()
+    print(f"Media probes spawned this run: {probe_cache['spawned']} ({probe_cache['indexed']} read from MP4 indexes)")
+    scratch.summary()
+    scratch.cleanup()
+    if args.profile:
+        profiler.write_trace(args.profile)
+        profiler.summary()
+
+
+def split_video_fast(args):
+    print("Starting video split process...")
+    progress.reset(args.progress_json)
+    profiler.reset(bool(args.profile))
+    scratch.reset(args.scratch_dir)
+    job = prepare_split(args)
+    if not job:
+        return None
+
+    render_thumbnails(job, args.thumbnail_workers)
+    progress.plan("segment" if args.engine == "segment" else "encode", job["context"]["duration"])
+    tasks = split_tasks(job)
+    jobs = max(1, args.jobs)
+    if jobs > 1 and len(tasks) > 1:
+        print(f"Encoding {len(tasks)} parts with {jobs} jobs ({job['context']['threads']} threads per job)")
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for files in executor.map(lambda task: task(), tasks):
+                job["generated_files"] += files
+    else:
+        for task in tasks:
+            job["generated_files"] += task()
+
+    parts = finish_split(job)
+    finish_run(args)
+    return parts
+
+
+async def split_video_async(args):
+    print("Starting asyncio video split process...")
+    progress.reset(args.progress_json)
+    profiler.reset(bool(args.profile))
+    scratch.reset(args.scratch_dir)
+    loop = asyncio.get_running_loop()
+    async_runner.update(loop=loop, timeout=args.task_timeout, stopping=False)
+    try:
+        configure_probe_cache(args.cache_dir)
+        if args.music_folder and os.path.exists(args.music_folder):
+            music_files = get_music_files_from_directory(args.music_folder)
+            print(f"Probing {len(music_files)} music tracks concurrently")
+            await asyncio.gather(*(loop.run_in_executor(None, get_audio_duration, path) for path in music_files))
+
+        job = await loop.run_in_executor(None, prepare_split, args)
+        if not job:
+            return None
+
+        thumbnails = loop.run_in_executor(None, render_thumbnails, job, args.thumbnail_workers)
+        if args.embed_thumbnail:
+            await thumbnails
+        progress.plan("segment" if args.engine == "segment" else "encode", job["context"]["duration"])
+        slots = asyncio.Semaphore(max(1, args.jobs))
+
+        async def run_task(task):
+            async with slots:
+                job["generated_files"] += await loop.run_in_executor(None, task)
+
+        await asyncio.gather(thumbnails, *(run_task(task) for task in split_tasks(job)))
+        parts = finish_split(job)
+        finish_run(args)
+        return parts
+    except asyncio.CancelledError:
+        print("Cancelled, stopping child processes")
+        async_runner["stopping"] = True
+        raise
+    finally:
+        async_runner.update(loop=None, timeout=None)
+
+
+def load_batch_manifest(batch_path):
+    print(f"Loading batch manifest: {batch_path}")
+    with open(batch_path, encoding='utf-8') as f:
+        entries = json.load(f)
+    if isinstance(entries, dict):
+        entries = entries.get("jobs", [])
+
+    parser = build_arg_parser()
+    batch_args = []
+    for entry in entries:
+        argv = []
+        for key, value in entry.items():
+            option = f"--{key.lstrip('-')}"
+            if value is True:
+                argv.append(option)
+            elif value is not None and value is not False:
+                argv.append(f"{option}={value}")
+        entry_args = parser.parse_args(argv)
+        if not entry_args.input or not entry_args.output_folder:
+            parser.error(f"batch entry {entry} needs both input and output_folder")
+        batch_args.append(entry_args)
+    return batch_args
+
+
+def run_batch(args):
+    print(f"Starting batch run: {args.batch}")
+    progress.reset(args.progress_json)
+    profiler.reset(bool(args.profile))
+    scratch.reset(args.scratch_dir)
+    jobs = max(1, args.jobs)
+    threads = threads_per_job(jobs) if jobs > 1 else None
+
+    batch = []
+    for entry_args in load_batch_manifest(args.batch):
+        job = prepare_split(entry_args, threads)
+        if job:
+            render_thumbnails(job, args.thumbnail_workers)
+            job["stats"] = {"started": None, "finished": None, "remaining": 0}
+            batch.append(job)
+    progress.plan("encode", sum(job["context"]["duration"] for job in batch if job["context"]["args"].engine == "parts"))
+    progress.plan("segment", sum(job["context"]["duration"] for job in batch if job["context"]["args"].engine == "segment"))
+
+    queues = [[(job, task) for task in split_tasks(job)] for job in batch]
+    scheduled = [item for round_items in itertools.zip_longest(*queues) for item in round_items if item]
+    for job, _ in scheduled:
+        job["stats"]["remaining"] += 1
+    stats_lock = threading.Lock()
+
+    def run_task(item):
+        job, task = item
+        with stats_lock:
+            job["stats"]["started"] = job["stats"]["started"] or time.monotonic()
+        files = task()
+        with stats_lock:
+            job["generated_files"] += files
+            job["stats"]["remaining"] -= 1
+            if not job["stats"]["remaining"]:
+                job["stats"]["finished"] = time.monotonic()
+                finish_split(job)
+
+    started = time.monotonic()
+    print(f"Scheduling {len(scheduled)} tasks from {len(batch)} inputs on {jobs} workers ({threads} threads per job)")
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        list(executor.map(run_task, scheduled))
+    elapsed = time.monotonic() - started
+
+    print("Batch summary:")
+    total_media = 0
+    for job in batch:
+        context = job["context"]
+        stats = job["stats"]
+        wall = (stats["finished"] or started) - (stats["started"] or started)
+        total_media += context["duration"]
+        output_bytes = sum(os.path.getsize(f) for f in job["generated_files"] if os.path.exists(f))
+        print(
+            f"  {context['args'].input}: {len(job['parts'])} parts, {context['duration']:.1f}s of media, "
+            f"{wall:.1f}s wall, {output_bytes / 1048576:.1f} MB written"
+        )
+    print(f"Overall: {total_media:.1f}s of media in {elapsed:.1f}s ({total_media / elapsed if elapsed else 0:.2f}x realtime)")
+    finish_run(args)
+    return batch
+
+
+def build_arg_parser():
     parser = argparse.ArgumentParser(description="Split and process videos with optional music, thumbnails, and letterbox text overlays.")
-    parser.add_argument('--input', required=True, help='Input video path')
+    parser.add_argument('--input', help='Input video path')
     parser.add_argument('--music_folder', help='Path to folder with background music')
     parser.add_argument('--bg_volume', type=float, default=0.05, help='Volume level for background music')
-    parser.add_argument('--output_folder', required=True, help='Path to output folder')
+    parser.add_argument('--output_folder', help='Path to output folder')
     parser.add_argument('--clip_length', type=int, default=90, help='Length of each video part in seconds')
     parser.add_argument('--trim_start', default="00:00:00", help='Start time to trim video (HH:MM:SS)')
     parser.add_argument('--trim_end', help='End time to trim video (HH:MM:SS)')
-    parser.add_argument('--video_naming_convention', default="clip ..part", help='Naming pattern for output video parts, use ..part')
+    parser.add_argument('--video_naming_convention', default="clip ..part", help='Naming pattern for output video parts, use ..part and ..rendition')
     parser.add_argument('--thumbnail_naming_convention', default="thumb ..part", help='Naming pattern for thumbnail files, use ..part')
     parser.add_argument('--music_file_name', help='Name of combined music file without extension')
     parser.add_argument('--letterbox_setting', help='Overlay text settings like "-top- text1 -bottom- text2"')
@@ -303,6 +1873,40 @@ if __name__ == "__main__":
     parser.add_argument('--letterbox_top_font', help='Font settings for top letterbox text (same format as thumbnail_font)')
     parser.add_argument('--letterbox_bottom_font', help='Font settings for bottom letterbox text (same format as thumbnail_font)')
     parser.add_argument('--video_transpose', type=int, help='Set transpose filter value (0=90°CW+vflip, 1=90°CW, 2=90°CCW, 3=90°CCW+vflip)')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of parts to encode in parallel (CPU threads are split between jobs)')
+    parser.add_argument('--engine', choices=['parts', 'segment'], default='parts', help='"parts" runs one ffmpeg per part, "segment" decodes once and cuts all parts with the segment muxer')
+    parser.add_argument('--keyframe_tolerance', type=float, help='How far (seconds) a part boundary may move to land on a keyframe for stream copy (default: clip_length / 10)')
+    parser.add_argument('--smart_encode', action='store_true', help='For untransposed H.264/HEVC inputs, re-encode only the head of each part that carries letterbox text and stream-copy the rest')
+    parser.add_argument('--progress_json', help='Append machine-readable progress events (JSON lines) to this file, or "-" for stdout')
+    parser.add_argument('--profile', help='Write a Chrome trace / Perfetto JSON file of every stage and subprocess and print a summary table')
+    parser.add_argument('--async', dest='async_run', action='store_true', help='Run children through an asyncio event loop: music tracks are probed concurrently, thumbnails render while parts encode, and Ctrl-C kills every running ffmpeg')
+    parser.add_argument('--task_timeout', type=float, help='With --async, kill any ffmpeg/ffprobe child that runs longer than this many seconds')
+    parser.add_argument('--batch', help='JSON manifest with a list of jobs (each an object of the options above) to run on one shared worker pool')
+    parser.add_argument('--thumbnail_max_size', type=int, default=1280, help='Longest side of rendered thumbnails in pixels (thumbnails follow the transposed output geometry)')
+    parser.add_argument('--thumbnail_workers', type=int, default=1, help='Number of threads used to render thumbnails')
+    parser.add_argument('--renditions', type=parse_renditions, help='Comma-separated WIDTHxHEIGHT sizes, e.g. "1080x1920,720x1280"; every part is decoded once and encoded at each size')
+    parser.add_argument('--thumbnail_mode', choices=['text', 'frame'], default='text', help='"text" draws the part name on a solid background, "frame" picks the sharpest sampled frame of each part and draws the name on it (needs NumPy)')
+    parser.add_argument('--embed_thumbnail', action='store_true', help='Attach each part\'s thumbnail as cover art. Text thumbnails are attached during the encode; frame thumbnails and the segment engine need a remux')
+    parser.add_argument('--thumbnail_samples', type=int, default=8, help='Number of low-resolution frames scored per part in frame thumbnail mode')
+    parser.add_argument('--scratch_dir', help='Directory for short-lived intermediates such as smart-encode heads, frame samples and temporary music beds (e.g. a tmpfs mount); defaults to the system temp directory')
+    parser.add_argument('--cache_dir', default=CACHE_DIR, help='Folder for persistent caches (media probes, music beds); pass an empty string to disable')
+    parser.add_argument('--music_cache_max_mb', type=float, default=2048, help='Maximum total size of cached music beds in MB (least recently used beds are evicted)')
+    parser.add_argument('--music_cache_max_age_days', type=float, default=30, help='Evict cached music beds not used for this many days')
+    return parser
 
+
+if __name__ == "__main__":
+    parser = build_arg_parser()
     args = parser.parse_args()
-    split_video_fast(args)
+    if args.batch:
+        run_batch(args)
+    elif not args.input or not args.output_folder:
+        parser.error("--input and --output_folder are required unless --batch is given")
+    elif args.async_run:
+        try:
+            asyncio.run(split_video_async(args))
+        except KeyboardInterrupt:
+            print("Interrupted, completed parts are kept in the manifest for the next run")
+            sys.exit(130)
+    else:
+        split_video_fast(args)